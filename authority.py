@@ -0,0 +1,156 @@
+import random
+import time
+
+import wire
+from tetris_core import Action, Config, GameState
+
+# Inputs may run ahead of the server clock by this fraction plus a fixed
+# burst of ticks (jitter, a stalled client frame) before they are rejected.
+TICK_SLACK = 0.1
+TICK_BURST = 5
+# Room for a held soft drop down the whole well plus a full slide and taps.
+MAX_ACTIONS = 64
+ACTIONS = frozenset((Action.LEFT, Action.RIGHT, Action.DROP, Action.ROTATE, Action.HOLD, Action.SOFT_DROP))
+# Garbage the target has not acknowledged after this many seconds is applied
+# by the server anyway, and the target is resynced. Honest clients ack on the
+# tick after it arrives, so this only catches clients dodging garbage.
+GARBAGE_DEADLINE = 3.0
+
+
+class InputError(ValueError):
+    pass
+
+
+class PlayerSim:
+    def __init__(self, player_id, name, room, seed, started):
+        self.player_id = player_id
+        self.name = name
+        self.room = room
+        self.game = GameState(seed)
+        self.game.board.journal = []
+        self.started = started
+        self.seq = 0
+        # gid -> (holes, time after which the server applies it itself)
+        self.garbage = {}
+
+    def header(self, kind, seq):
+        # "type" first: relays look for it in the start of the frame only.
+        game = self.game
+        return {"type": kind, "id": self.player_id, "name": self.name, "score": game.score,
+                "piece": game.current_piece.shape, "seq": seq}
+
+    def board_message(self):
+        if self.seq % wire.KEYFRAME_INTERVAL == 0:
+            msg = self.header("board", self.seq)
+            msg["locked"] = list(self.game.board.locked.items())
+        else:
+            msg = self.header("board_delta", self.seq)
+            msg["ops"] = self.game.board.journal
+        self.game.board.journal = []
+        self.seq += 1
+        return msg
+
+    def snapshot(self):
+        # A keyframe of the last sent state that does not use up a seq, for
+        # peers joining mid-game.
+        msg = self.header("board", self.seq - 1)
+        msg["locked"] = list(self.game.board.locked.items())
+        return msg
+
+
+class Authority:
+    # Runs every player's game on the server. Clients send their inputs per
+    # gravity tick; the server replays them with the same seeded rules, picks
+    # garbage targets and holes, and produces the board updates peers see.
+    def __init__(self, fall_interval=0.8, seed=None, clock=time.monotonic):
+        self.fall_interval = fall_interval
+        self.rng = random.Random(seed)
+        self.clock = clock
+        self.players = {}
+        self.rooms = {}
+        self.next_gid = 0
+
+    def join(self, room, player_id, name):
+        # Returns the new player's sim, the messages for the joiner and the
+        # messages for the rest of the room.
+        if player_id in self.players:
+            raise InputError(f"player {player_id} is already playing")
+        sim = PlayerSim(player_id, str(name)[:64], room, self.rng.getrandbits(32), self.clock())
+        members = self.rooms.setdefault(room, set())
+        reply = [self.players[pid].snapshot() for pid in sorted(members)]
+        members.add(player_id)
+        self.players[player_id] = sim
+        return sim, reply, [sim.board_message()]
+
+    def leave(self, player_id):
+        sim = self.players.pop(player_id, None)
+        if sim is None:
+            return
+        members = self.rooms.get(sim.room)
+        members.discard(player_id)
+        if not members:
+            del self.rooms[sim.room]
+
+    def validate(self, sim, msg):
+        tick = msg.get("tick")
+        if type(tick) is not int or tick != sim.game.ticks + 1:
+            raise InputError(f"expected tick {sim.game.ticks + 1}, got {tick!r}")
+        allowed = (self.clock() - sim.started) / self.fall_interval * (1 + TICK_SLACK) + TICK_BURST
+        if tick > allowed:
+            raise InputError(f"tick {tick} is ahead of the clock ({allowed:.0f} allowed)")
+        actions = msg.get("actions", [])
+        if not isinstance(actions, list) or len(actions) > MAX_ACTIONS:
+            raise InputError("too many actions in one tick")
+        if any(type(a) is not int or a not in ACTIONS for a in actions):
+            raise InputError(f"unknown action in {actions!r}")
+        acks = msg.get("garbage", [])
+        if not isinstance(acks, list):
+            raise InputError("garbage acks must be a list")
+        return actions, acks
+
+    def handle_input(self, player_id, msg):
+        # One input frame: the actions taken during a tick, the garbage the
+        # client applied after them, then the gravity tick itself. Returns
+        # (messages for the room, messages for the player).
+        sim = self.players[player_id]
+        game = sim.game
+        if game.game_over:
+            return [], []
+        actions, acks = self.validate(sim, msg)
+
+        for action in actions:
+            game.step(action)
+        for gid in acks:
+            # Unknown ids were already forced in; the hash check below resyncs.
+            if gid in sim.garbage:
+                game.apply_garbage(sim.garbage.pop(gid)[0])
+        lines = game.tick()
+
+        now = self.clock()
+        forced = [gid for gid, (_, deadline) in sim.garbage.items() if now >= deadline]
+        for gid in forced:
+            game.apply_garbage(sim.garbage.pop(gid)[0])
+
+        room, reply = [], []
+        if game.board.journal:
+            room.append(sim.board_message())
+        if lines > 1:
+            garbage = self.send_garbage(sim, lines - 1)
+            if garbage is not None:
+                room.append(garbage)
+        if forced or ("hash" in msg and msg["hash"] != game.board.hash):
+            reply.append({"type": "resync", "locked": list(game.board.locked.items()), "score": game.score})
+        return room, reply
+
+    def send_garbage(self, sim, amount):
+        targets = sorted(pid for pid in self.rooms[sim.room]
+                         if pid != sim.player_id and not self.players[pid].game.game_over)
+        if not targets:
+            return None
+        target = self.players[self.rng.choice(targets)]
+        gid = self.next_gid
+        self.next_gid += 1
+        holes = [self.rng.randrange(Config.COLS) for _ in range(amount)]
+        target.garbage[gid] = (holes, self.clock() + GARBAGE_DEADLINE)
+        return {"type": "garbage", "from": sim.player_id, "to": target.player_id,
+                "amount": amount, "gid": gid, "holes": holes}
@@ -0,0 +1,54 @@
+# Micro-benchmark for Piece.cells and Board.valid_space.
+# Run from the repo root: python -m benchmarks.piece_cells
+import timeit
+
+from tetris_core import Board, Config, Piece
+
+
+def legacy_cells(piece, rotation=None, dx=0, dy=0):
+    rot = piece.rotation if rotation is None else rotation
+    return [(piece.x + cx + dx, piece.y + cy + dy)
+            for cx, cy in Config.SHAPES[piece.shape][rot]]
+
+
+def legacy_valid_space(board, piece, rotation=None, dx=0, dy=0):
+    for x, y in legacy_cells(piece, rotation, dx, dy):
+        if x < 0 or x >= Config.COLS or y >= Config.ROWS:
+            return False
+        if y >= 0 and board.rows[y] >> x & 1:
+            return False
+    return True
+
+
+def make_board():
+    board = Board()
+    for y in range(Config.ROWS - 8, Config.ROWS):
+        for x in range(Config.COLS):
+            if (x * 7 + y * 3) % 5:
+                board.set_cell(x, y, Config.GARBAGE_COLOR)
+    return board
+
+
+def bench(label, func, number):
+    best = min(timeit.repeat(func, number=number, repeat=5))
+    ns = best / number * 1e9
+    print(f"{label:<28}{ns:10.1f} ns/call")
+    return ns
+
+
+def main(number=200000):
+    board = make_board()
+    piece = Piece("T")
+    piece.y = 8
+
+    before = bench("cells (before)", lambda: legacy_cells(piece, dy=1), number)
+    after = bench("cells (after)", lambda: piece.cells(dy=1), number)
+    print(f"{'':<28}{before / after:10.2f}x")
+
+    before = bench("valid_space (before)", lambda: legacy_valid_space(board, piece, dy=1), number)
+    after = bench("valid_space (after)", lambda: board.valid_space(piece, dy=1), number)
+    print(f"{'':<28}{before / after:10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+# Load test for the room relay: python -m benchmarks.relay_load --clients 1000
+# Starts server.py in each --modes setting on a local port (or targets a
+# running server with --port), connects the clients in rooms of --room-size
+# and replays the NetworkGame protocol: a join, then one board update per
+# placed piece at --rate per second (a keyframe every 10th update, deltas in
+# between) and the garbage those placements would send. The updates come
+# from a recorded bot game, so message sizes match a real match.
+# Reports relay latency percentiles, throughput, garbage delivery and server
+# memory per connection; --out writes the results as JSON for comparison.
+# --slow-clients adds one client per room (for that many rooms) that joins
+# and then never reads, to show how a stalled peer affects its room.
+# --tick-rate runs the asyncio relay with batched broadcasts at those rates.
+# --workers runs the asyncio relay sharded over that many processes; use it
+# with --client-procs so the load generator is not the bottleneck, e.g.
+#   python -m benchmarks.relay_load --modes asyncio --workers 1 2 4 --client-procs 4
+import argparse, asyncio, json, os, random, socket, statistics, subprocess, sys, threading, time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import wire
+from bot import Bot, play
+from tetris_core import GameState
+
+SCORE_AT = wire.HEADER.size + 1
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, port, workers=1, tick_rate=0):
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "server.py"), "--host", "127.0.0.1", "--port", str(port),
+         "--mode", mode, "--workers", str(workers), "--tick-rate", str(tick_rate)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def record_trace(seed, updates):
+    # (message, garbage amount) per placed piece, as NetworkGame.update sends them.
+    trace = []
+    bot = Bot(beam_width=4, depth=1)
+    while len(trace) < updates:
+        game = GameState(seed + len(trace))
+        game.board.journal = []
+        while not game.game_over and len(trace) < updates:
+            lines = play(game, bot)
+            seq = len(trace)
+            msg = {"piece": game.current_piece.shape, "seq": seq}
+            if seq % wire.KEYFRAME_INTERVAL == 0:
+                msg["type"] = "board"
+                msg["locked"] = list(game.board.locked.items())
+            else:
+                msg["type"] = "board_delta"
+                msg["ops"] = game.board.journal
+            game.board.journal = []
+            trace.append((msg, max(0, lines - 1)))
+    return trace
+
+
+def now_us():
+    # The send time rides in the score field (u32 in bin1), so it wraps.
+    return time.monotonic_ns() // 1000 & 0xFFFFFFFF
+
+
+def sent_at(frame, fmt):
+    if fmt == wire.BINARY:
+        if frame[wire.HEADER.size] not in (wire.MSG_BOARD, wire.MSG_BOARD_DELTA):
+            return None
+        return int.from_bytes(frame[SCORE_AT:SCORE_AT + 4], "big")
+    start = bytes(frame[:256]).find(b'"score": ')
+    if start < 0:
+        return None
+    start += 9
+    end = start
+    while 48 <= frame[end] <= 57:
+        end += 1
+    return int(bytes(frame[start:end]))
+
+
+def tree_rss_kb(pid):
+    # RSS of a process and its children (the sharded relay forks workers).
+    pids = {pid}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            if ppid == pid:
+                pids.add(int(entry))
+    total = 0
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return total
+
+
+class MemorySampler(threading.Thread):
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.idle_kb = tree_rss_kb(pid)
+        self.peak_kb = self.idle_kb
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            self.peak_kb = max(self.peak_kb, tree_rss_kb(self.pid))
+
+
+class Stats:
+    def __init__(self):
+        self.connected = 0
+        self.failed = 0
+        self.binary = 0
+        self.sent = 0
+        self.expected = 0
+        self.received = 0
+        self.received_bytes = 0
+        self.garbage_sent = 0
+        self.garbage_expected = 0
+        self.garbage_received = 0
+        self.latencies = []
+
+    def merge(self, other):
+        for name, value in vars(other).items():
+            setattr(self, name, getattr(self, name) + value)
+
+
+async def run_slow_client(host, port, room, stop_at):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(wire.encode({"type": "join", "room": room}, wire.JSON))
+    await asyncio.sleep(stop_at - time.monotonic() + 1.0)
+    writer.close()
+
+
+async def run_client(host, port, room, client_id, stats, stop_at, rate, trace, members, fmt):
+    try:
+        reader, writer = await asyncio.open_connection(host, port, limit=1 << 20)
+    except OSError:
+        stats.failed += 1
+        return
+    stats.connected += 1
+    join = {"type": "join", "room": room, "name": client_id}
+    if fmt == wire.BINARY:
+        join["formats"] = list(wire.FORMATS)
+    writer.write(wire.encode(join, wire.JSON))
+    negotiated = asyncio.get_running_loop().create_future()
+
+    async def receive():
+        frames = wire.FrameBuffer()
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            stats.received_bytes += len(data)
+            pending = deque(frames.feed(data))
+            while pending:
+                frame = pending.popleft()
+                if frames.format == wire.JSON and b'"welcome"' in bytes(frame[:64]):
+                    pending = deque(frames.switch_format(wire.BINARY, pending))
+                    negotiated.set_result(wire.BINARY)
+                    continue
+                if wire.peek_type(frame, frames.format) == "garbage":
+                    stats.garbage_received += 1
+                    continue
+                sent = sent_at(frame, frames.format)
+                if sent is not None:
+                    stats.latencies.append(((now_us() - sent) & 0xFFFFFFFF) / 1000)
+                    stats.received += 1
+
+    receiver = asyncio.create_task(receive())
+    if fmt == wire.BINARY:
+        # The threaded relay never answers, so fall back like negotiate_format does.
+        try:
+            fmt = await asyncio.wait_for(asyncio.shield(negotiated), 2.0)
+        except asyncio.TimeoutError:
+            fmt = wire.JSON
+    stats.binary += fmt == wire.BINARY
+
+    peers = [member for member in members if member != client_id]
+    interval = 1 / rate
+    i = random.randrange(len(trace))
+    await asyncio.sleep(random.random() * interval)
+    try:
+        while time.monotonic() < stop_at:
+            msg, garbage = trace[i % len(trace)]
+            i += 1
+            # Score first so receivers find the timestamp without scanning the board.
+            msg = dict(score=now_us(), id=client_id, name=client_id, **msg)
+            writer.write(wire.encode(msg, fmt))
+            stats.sent += 1
+            stats.expected += len(peers)
+            if garbage and peers:
+                writer.write(wire.encode({"type": "garbage", "from": client_id, "to": random.choice(peers),
+                                          "amount": garbage}, fmt))
+                stats.garbage_sent += 1
+                stats.garbage_expected += len(peers)
+            await writer.drain()
+            await asyncio.sleep(interval)
+        # Let in-flight messages arrive before hanging up.
+        await asyncio.sleep(1.0)
+    except OSError:
+        pass
+    finally:
+        receiver.cancel()
+        writer.close()
+
+
+async def load(host, port, clients, room_size, rate, duration, trace, fmt, slow_clients=0, part=0, parts=1):
+    # With parts > 1 this process only drives the rooms r with r % parts == part.
+    stats = Stats()
+    stop_at = time.monotonic() + duration
+    tasks = [asyncio.create_task(run_slow_client(host, port, f"load-{i}", stop_at))
+             for i in range(part, slow_clients, parts)]
+    for i in range(clients):
+        if i // room_size % parts != part:
+            continue
+        room = f"load-{i // room_size}"
+        first = i // room_size * room_size
+        members = [f"c{j}" for j in range(first, min(first + room_size, clients))]
+        client_fmt = fmt if fmt != "mixed" else (wire.BINARY if i % 2 else wire.JSON)
+        tasks.append(asyncio.create_task(
+            run_client(host, port, room, f"c{i}", stats, stop_at, rate, trace, members, client_fmt)))
+        if i % 100 == 99:
+            await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    return stats
+
+
+def load_part(args):
+    return asyncio.run(load(*args))
+
+
+def run_load(host, port, args, trace):
+    params = (host, port, args.clients, args.room_size, args.rate, args.duration, trace,
+              args.format, args.slow_clients)
+    if args.client_procs == 1:
+        return load_part(params)
+    stats = Stats()
+    with ProcessPoolExecutor(args.client_procs) as pool:
+        for part in pool.map(load_part, [params + (i, args.client_procs) for i in range(args.client_procs)]):
+            stats.merge(part)
+    return stats
+
+
+def summarize(mode, stats, clients, duration, memory=None):
+    latencies = sorted(stats.latencies) or [float("nan")]
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+    result = {
+        "mode": mode,
+        "clients": clients,
+        "connected": stats.connected,
+        "failed": stats.failed,
+        "binary": stats.binary,
+        "sent": stats.sent,
+        "received": stats.received,
+        "expected": stats.expected,
+        "garbage_sent": stats.garbage_sent,
+        "garbage_received": stats.garbage_received,
+        "garbage_expected": stats.garbage_expected,
+        "msgs_per_sec": round(stats.received / duration, 1),
+        "mb_per_sec": round(stats.received_bytes / duration / 1e6, 2),
+        "p50_ms": round(pick(0.50), 2),
+        "p99_ms": round(pick(0.99), 2),
+        "p999_ms": round(pick(0.999), 2),
+        "mean_ms": round(statistics.fmean(latencies), 2),
+    }
+    if memory is not None:
+        result["server_rss_mb"] = round(memory.peak_kb / 1024, 1)
+        result["rss_per_conn_kb"] = round((memory.peak_kb - memory.idle_kb) / max(1, stats.connected), 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Relay latency load test for server.py")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--room-size", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=2.0, help="board updates per client per second")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--format", choices=(wire.JSON, wire.BINARY, "mixed"), default=wire.JSON)
+    parser.add_argument("--trace", type=int, default=200, help="recorded board updates to cycle through")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--slow-clients", type=int, default=0)
+    parser.add_argument("--modes", nargs="+", default=["asyncio", "threads"])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1],
+                        help="relay process counts to try for the asyncio mode")
+    parser.add_argument("--tick-rate", type=float, nargs="+", default=[0],
+                        help="relay batching rates to try for the asyncio mode (0 sends immediately)")
+    parser.add_argument("--client-procs", type=int, default=1, help="load generator processes")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="load an already running server instead of starting one")
+    parser.add_argument("--server-pid", type=int, help="with --port, sample this process for memory use")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    trace = record_trace(args.seed, args.trace)
+    if args.port is not None:
+        runs = [("external", 1, None)]
+    else:
+        runs = [(mode, workers, tick_rate) for mode in args.modes
+                for workers in (args.workers if mode == "asyncio" else [1])
+                for tick_rate in (args.tick_rate if mode == "asyncio" else [0])]
+
+    results = []
+    for mode, workers, tick_rate in runs:
+        if args.port is not None:
+            host, port, proc = args.host, args.port, None
+            pid = args.server_pid
+        else:
+            host, port = "127.0.0.1", free_port()
+            proc = start_server(mode, port, workers, tick_rate)
+            pid = proc.pid
+            time.sleep(0.5)
+        memory = MemorySampler(pid) if pid is not None and os.path.exists("/proc") else None
+        if memory is not None:
+            memory.start()
+        try:
+            stats = run_load(host, port, args, trace)
+        finally:
+            if memory is not None:
+                memory.done.set()
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+        result = summarize(mode, stats, args.clients, args.duration, memory)
+        result["workers"] = workers
+        result["tick_rate"] = tick_rate
+        result["format"] = args.format
+        results.append(result)
+        print(json.dumps(result))
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
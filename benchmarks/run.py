@@ -0,0 +1,278 @@
+# Benchmark suite for the hot paths: board operations, the client's wire
+# encode/decode, and the renderer (on SDL's dummy video driver, so it runs
+# headless). Everything is built from fixed seeds, so two runs time the same
+# work. Run from the repo root:
+#   python -m benchmarks.run --out results.json
+#   python -m benchmarks.run --baseline results.json   # exits 1 on a regression
+# Baselines are only comparable on the same machine; record one before a
+# change and compare after it. --filter runs the cases whose name contains it.
+import argparse, json, os, platform, random, sys, timeit
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pygame
+
+import wire
+from bot import Bot, play
+from client import NetworkGame
+from tetris_core import Board, Config, Game, GameState, Piece, Renderer
+
+SEED = 1234
+# Stack heights for the board cases: early game, mid game, near top-out.
+HEIGHTS = {"low": 4, "mid": 10, "high": 16}
+REPEAT = 5
+# Per-call time may grow by this fraction over the baseline before it fails.
+THRESHOLD = 0.25
+
+
+def stacked_board(height, rng, full_rows=0):
+    # Every row of the stack is full but for one hole, except the top two,
+    # which are ragged; full_rows of the rows are then completed.
+    board = Board()
+    for y in range(Config.ROWS - height, Config.ROWS):
+        hole = rng.randrange(Config.COLS)
+        for x in range(Config.COLS):
+            if x != hole and (rng.random() < 0.7 or y > Config.ROWS - height + 1):
+                board.set_cell(x, y, Config.GARBAGE_COLOR)
+    for y in rng.sample(range(Config.ROWS - height, Config.ROWS), min(full_rows, height)):
+        for x in range(Config.COLS):
+            board.set_cell(x, y, Config.COLORS["T"])
+    return board
+
+
+def game_on(board, seed):
+    game = GameState(seed)
+    game.board = board
+    return game
+
+
+def probes(board, rng, count=64):
+    # Pieces at random reachable-looking spots above the stack, as the bot
+    # and the DAS repeater ask for them.
+    found = []
+    while len(found) < count:
+        piece = Piece(rng.choice(list(Config.SHAPES)))
+        piece.rotation = rng.randrange(4)
+        piece.x = rng.randrange(-1, Config.COLS - 1)
+        piece.y = rng.randrange(Config.ROWS - 2)
+        found.append((piece, rng.choice((-1, 0, 1)), rng.choice((0, 1))))
+    return found
+
+
+def sample_game(seed, pieces=40):
+    # A bot-played mid-game board whose journal holds the ops of the last
+    # three placements, as a NetworkGame delta would.
+    game = GameState(seed)
+    player = Bot(beam_width=4, depth=1)
+    while game.pieces < pieces and not game.game_over:
+        if game.pieces <= pieces - 3:
+            game.board.journal = []
+        play(game, player)
+    return game
+
+
+class NullSocket:
+    def sendall(self, data):
+        pass
+
+
+def network_game(seed, fmt):
+    # A NetworkGame without a connection or window; only what
+    # send_board_state touches is set up.
+    source = sample_game(seed)
+    game = NetworkGame.__new__(NetworkGame)
+    GameState.__init__(game, seed)
+    game.board = source.board
+    game.score = source.score
+    game.sock = NullSocket()
+    game.wire_format = fmt
+    game.player_id = "2f1c6c1e-8a4e-4bd4-9d0c-5b8f1f6c2a10"
+    game.player_name = "Player"
+    game.board_seq = 0
+    return game, source.board.journal
+
+
+def timed(func, number=None):
+    timer = timeit.Timer(func)
+    if number is None:
+        number, _ = timer.autorange()
+    return min(timer.repeat(REPEAT, number)) / number, number
+
+
+def timed_fresh(make, func, number):
+    # For calls that mutate their input: each repeat times func over
+    # `number` objects built beforehand.
+    best = None
+    for _ in range(REPEAT):
+        items = [make() for _ in range(number)]
+        it = iter(items)
+        elapsed = timeit.Timer(lambda: func(next(it))).timeit(number)
+        best = elapsed if best is None else min(best, elapsed)
+    return best / number, number
+
+
+def board_cases(rng):
+    for label, height in HEIGHTS.items():
+        board = stacked_board(height, rng)
+        checks = probes(board, rng)
+        yield f"board.valid_space[{label}]", lambda board=board, checks=checks: [
+            board.valid_space(piece, dy=dy, dx=dx) for piece, dx, dy in checks], len(checks)
+
+        full = stacked_board(height, rng, full_rows=2)
+        yield f"board.clear_lines[{label}]", (full.copy, Board.clear_lines, 2000), 1
+
+        garbage_rng = random.Random(SEED)
+        yield f"board.add_garbage_lines[{label}]", (
+            board.copy, lambda b: b.add_garbage_lines(2, garbage_rng), 2000), 1
+
+        placed = [piece for piece, _, _ in checks if board.valid_space(piece)]
+        yield f"board.drop_distance[{label}]", lambda board=board, placed=placed: [
+            board.drop_distance(piece) for piece in placed], len(placed)
+
+        game = game_on(board.copy(), SEED)
+        yield f"game.get_ghost_cells[{label}]", game.get_ghost_cells, 1
+        yield f"board.create_grid[{label}]", board.create_grid, 1
+
+
+def wire_cases():
+    for fmt in (wire.JSON, wire.BINARY):
+        game, ops = network_game(SEED, fmt)
+
+        def keyframe(game=game):
+            game.board_seq = 0
+            game._send_board_state()
+
+        def delta(game=game, ops=ops):
+            game.board_seq = 1
+            game.board.journal = ops
+            game._send_board_state()
+
+        yield f"send_board_state.keyframe[{fmt}]", keyframe, 1
+        yield f"send_board_state.delta[{fmt}]", delta, 1
+
+        for kind, seq in (("keyframe", 0), ("delta", 1)):
+            game.board_seq = seq
+            game.board.journal = ops
+            msg = {"id": game.player_id, "name": game.player_name, "score": game.score,
+                   "piece": game.current_piece.shape, "seq": seq}
+            if seq:
+                msg.update(type="board_delta", ops=ops)
+            else:
+                msg.update(type="board", locked=list(game.board.locked.items()))
+            frame = wire.encode(msg, fmt)
+
+            def receive(frame=frame, fmt=fmt):
+                # What NetworkGame.receive does per chunk holding one frame.
+                return [wire.decode(f, fmt) for f in wire.FrameBuffer(fmt).feed(frame)]
+
+            yield f"receive.{kind}[{fmt}]", receive, 1
+
+
+def render_cases(rng):
+    pygame.init()
+    screen = pygame.display.set_mode((Config.WIDTH, Config.HEIGHT))
+    renderer = Renderer(screen)
+    game = sample_game(SEED)
+    board = game.board
+    piece = game.current_piece
+    ghost = game.get_ghost_cells()
+
+    def draw(call):
+        def run():
+            call()
+            renderer.rects.clear()
+        return run
+
+    def redraw_board():
+        # A board that changed since the last frame: the playfield is re-rendered.
+        board.version += 1
+        renderer.draw_board(board)
+        renderer.rects.clear()
+
+    yield "render.draw_board[cached]", draw(lambda: renderer.draw_board(board)), 1
+    yield "render.draw_board[changed]", redraw_board, 1
+    yield "render.draw_piece", draw(lambda: renderer.draw_piece(piece)), 1
+    yield "render.draw_ghost_piece", draw(lambda: renderer.draw_ghost_piece(piece, ghost)), 1
+    yield "render.draw_next_piece", draw(lambda: renderer.draw_next_piece(game.next_piece)), 1
+    yield "render.draw_hold_piece", draw(lambda: renderer.draw_hold_piece(Piece("T"))), 1
+    yield "render.draw_player_info", draw(lambda: renderer.draw_player_info("Player", game.score)), 1
+    opp = {"board": stacked_board(HEIGHTS["mid"], rng)}
+    yield "render.draw_opponent_board", draw(lambda: renderer.draw_opponent_board(opp, 10, 10)), 1
+
+    frame = Game(SEED)
+    frame.board = board.copy()
+
+    def full_frame():
+        # Every frame changes: the piece moves, as it does while a key is held.
+        frame.current_piece.x = 3 if frame.current_piece.x != 3 else 4
+        frame.draw()
+
+    yield "render.game_draw[frame]", full_frame, 1
+
+
+def run(name_filter=None):
+    rng = random.Random(SEED)
+    results = {}
+    for cases in (board_cases(rng), wire_cases(), render_cases(rng)):
+        for name, case, per in cases:
+            if name_filter and name_filter not in name:
+                continue
+            if isinstance(case, tuple):
+                seconds, number = timed_fresh(*case)
+            else:
+                seconds, number = timed(case)
+            results[name] = {"us": round(seconds / per * 1e6, 3), "number": number}
+            print(f"{name:<40}{results[name]['us']:12.2f} us")
+    return results
+
+
+def compare(results, baseline, threshold):
+    # Returns the names of the cases slower than baseline * (1 + threshold).
+    regressions = []
+    print(f"\n{'case':<40}{'baseline':>12}{'now':>12}{'change':>9}")
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<40}{'-':>12}{result['us']:12.2f}{'new':>9}")
+            continue
+        change = result["us"] / before["us"] - 1 if before["us"] else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<40}{before['us']:12.2f}{result['us']:12.2f}{change:+9.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the core, network and rendering hot paths.")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against results saved with --out")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="allowed slowdown per case as a fraction (default %(default)s)")
+    parser.add_argument("--filter", help="only run cases whose name contains this")
+    args = parser.parse_args()
+
+    results = run(args.filter)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"meta": {"seed": SEED, "repeat": REPEAT, "python": platform.python_version(),
+                                "pygame": pygame.version.ver, "machine": platform.machine(),
+                                "platform": platform.platform()},
+                       "results": results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print(f"\nno regressions over {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
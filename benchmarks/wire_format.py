@@ -0,0 +1,48 @@
+# Bytes on the wire and encode/decode cost for JSON vs binary frames.
+# Run from the repo root: python -m benchmarks.wire_format
+import random
+import timeit
+import uuid
+
+import wire
+from tetris_core import Action, GameState
+
+
+def sample_messages(seed=0):
+    # A mid-game board from a seeded game, plus a typical delta and garbage message.
+    game = GameState(seed)
+    rng = random.Random(seed)
+    game.board.journal = []
+    while game.pieces < 40 and not game.game_over:
+        game.step(rng.choice((Action.LEFT, Action.RIGHT, Action.ROTATE)))
+        game.step(Action.DROP)
+        game.tick()
+    player_id = str(uuid.UUID(int=rng.getrandbits(128)))
+    base = {"id": player_id, "name": "Player", "score": game.score, "piece": game.current_piece.shape, "seq": 40}
+    delta_ops = game.board.journal[-2:]
+    game.add_garbage_lines(2)
+    delta_ops += game.board.journal[-1:]
+    return {
+        "board": dict(base, type="board", locked=[[list(pos), list(color)] for pos, color in game.board.locked.items()]),
+        "board_delta": dict(base, type="board_delta", ops=delta_ops),
+        "garbage": {"type": "garbage", "from": player_id, "to": str(uuid.UUID(int=rng.getrandbits(128))), "amount": 3},
+    }
+
+
+def per_call_us(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def main(number=2000):
+    print(f"{'message':<12}{'format':<7}{'bytes':>7}{'encode us':>11}{'decode us':>11}")
+    for name, msg in sample_messages().items():
+        for fmt in (wire.JSON, wire.BINARY):
+            frame = wire.encode(msg, fmt)
+            assert wire.decode(frame, fmt)["type"] == msg["type"]
+            encode = per_call_us(lambda: wire.encode(msg, fmt), number)
+            decode = per_call_us(lambda: wire.decode(frame, fmt), number)
+            print(f"{name:<12}{fmt:<7}{len(frame):>7}{encode:>11.1f}{decode:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+import time
+from collections import OrderedDict, deque
+
+from tetris_core import Action, Config, Piece
+
+# Pseudo-action for a single gravity step; play() turns it into game.tick().
+DOWN = "down"
+
+MOVES = ((Action.LEFT, -1, 0, 0), (Action.RIGHT, 1, 0, 0), (Action.ROTATE, 0, 0, 1), (DOWN, 0, 1, 0))
+
+
+class Placement:
+    __slots__ = ("shape", "x", "y", "rotation", "cells", "path", "hold")
+
+    def __init__(self, shape, x, y, rotation, cells, path, hold=False):
+        self.shape = shape
+        self.x = x
+        self.y = y
+        self.rotation = rotation
+        self.cells = cells
+        self.path = path
+        self.hold = hold
+
+    def piece(self):
+        piece = Piece(self.shape)
+        piece.x, piece.y, piece.rotation = self.x, self.y, self.rotation
+        return piece
+
+    def __repr__(self):
+        return f"Placement({self.shape!r}, x={self.x}, y={self.y}, rotation={self.rotation}, hold={self.hold})"
+
+
+def enumerate_placements(board, shape, x=None, y=None, rotation=0, hold=False):
+    piece = Piece(shape)
+    if x is not None:
+        piece.x = x
+    if y is not None:
+        piece.y = y
+    piece.rotation = rotation
+    if not board.valid_space(piece):
+        return []
+
+    start = (piece.x, piece.y, piece.rotation)
+    parents = {start: None}
+    queue = deque([start])
+    resting = {}
+
+    while queue:
+        state = queue.popleft()
+        piece.x, piece.y, piece.rotation = state
+        for action, dx, dy, drot in MOVES:
+            rot = (piece.rotation + drot) % 4
+            if not board.valid_space(piece, rotation=rot, dx=dx, dy=dy):
+                if action is DOWN:
+                    cells = tuple(sorted(piece.cells()))
+                    # BFS order means the first state to reach a resting cell set has the shortest path.
+                    if cells not in resting:
+                        resting[cells] = state
+                continue
+            nxt = (piece.x + dx, piece.y + dy, rot)
+            if nxt not in parents:
+                parents[nxt] = (state, action)
+                queue.append(nxt)
+
+    placements = []
+    for cells, state in resting.items():
+        placements.append(Placement(shape, state[0], state[1], state[2], cells, _path(parents, state), hold))
+    return placements
+
+
+def _path(parents, state):
+    path = []
+    while parents[state] is not None:
+        state, action = parents[state]
+        path.append(action)
+    path.reverse()
+    # A trailing run of gravity steps is a hard drop.
+    drops = 0
+    while path and path[-1] is DOWN:
+        path.pop()
+        drops += 1
+    if drops:
+        path.append(Action.DROP)
+    return path
+
+
+def game_placements(game):
+    piece = game.current_piece
+    placements = enumerate_placements(game.board, piece.shape, piece.x, piece.y, piece.rotation)
+    if game.can_hold:
+        shape = game.hold_piece.shape if game.hold_piece is not None else game.next_piece.shape
+        placements += enumerate_placements(game.board, shape, hold=True)
+    return placements
+
+
+def apply_placement(board, placement):
+    board = board.copy()
+    board.lock_piece(placement.piece())
+    return board, board.clear_lines()
+
+
+def board_features(board):
+    heights = board.heights()
+    # A hole is an empty cell under the top of its column.
+    holes = sum(height - bin(col).count("1") for height, col in zip(heights, board.cols))
+    bumpiness = sum(abs(heights[i] - heights[i + 1]) for i in range(Config.COLS - 1))
+    return sum(heights), holes, bumpiness, max(heights)
+
+
+class HeuristicEvaluator:
+    def __init__(self, height=-0.51, lines=0.76, holes=-0.36, bumpiness=-0.18, max_height=0.0):
+        self.weights = (height, lines, holes, bumpiness, max_height)
+
+    def __call__(self, board, lines):
+        aggregate, holes, bumpiness, max_height = board_features(board)
+        w_height, w_lines, w_holes, w_bumpiness, w_max = self.weights
+        return (w_height * aggregate + w_lines * lines + w_holes * holes
+                + w_bumpiness * bumpiness + w_max * max_height)
+
+
+class TranspositionCache:
+    def __init__(self, max_entries=100000, ttl=None, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, stored = entry
+        if self.ttl is not None and self.clock() - stored > self.ttl:
+            del self.entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = (value, self.clock() if self.ttl is not None else 0)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class _Node:
+    __slots__ = ("board", "hold_shape", "queue", "can_hold", "lines", "value", "first")
+
+    def __init__(self, board, hold_shape, queue, can_hold, lines, value, first):
+        self.board = board
+        self.hold_shape = hold_shape
+        self.queue = queue
+        self.can_hold = can_hold
+        self.lines = lines
+        self.value = value
+        self.first = first
+
+
+class Bot:
+    def __init__(self, evaluator=None, beam_width=8, depth=2, cache=None):
+        self.evaluator = evaluator or HeuristicEvaluator()
+        self.beam_width = beam_width
+        self.depth = depth
+        # Board.hash only covers occupancy, which is all placements and the evaluator look at.
+        self.cache = cache if cache is not None else TranspositionCache()
+
+    def placements(self, board, shape, x=None, y=None, rotation=0, hold=False):
+        # Spell out the spawn position so the current piece at spawn shares entries with lookahead.
+        x = Config.COLS // 2 - 2 if x is None else x
+        y = 0 if y is None else y
+        key = ("placements", board.hash, shape, x, y, rotation, hold)
+        placements = self.cache.get(key)
+        if placements is None:
+            placements = enumerate_placements(board, shape, x, y, rotation, hold)
+            self.cache.put(key, placements)
+        return placements
+
+    def evaluate(self, board, lines):
+        key = ("value", board.hash, lines)
+        value = self.cache.get(key)
+        if value is None:
+            value = self.evaluator(board, lines)
+            self.cache.put(key, value)
+        return value
+
+    def expand(self, node, spawn_state=None):
+        # Yields (placement, hold_shape, queue) for the piece at the head of the queue,
+        # and for the hold alternative when holding is allowed.
+        current, rest = node.queue[0], node.queue[1:]
+        x, y, rotation = spawn_state or (None, None, 0)
+        for placement in self.placements(node.board, current, x, y, rotation):
+            yield placement, node.hold_shape, rest
+        if not node.can_hold:
+            return
+        if node.hold_shape is not None:
+            for placement in self.placements(node.board, node.hold_shape, hold=True):
+                yield placement, current, rest
+        elif rest:
+            for placement in self.placements(node.board, rest[0], hold=True):
+                yield placement, current, rest[1:]
+
+    def search(self, board, queue, hold_shape=None, can_hold=True, spawn_state=None):
+        beam = [_Node(board, hold_shape, tuple(queue), can_hold, 0, 0.0, None)]
+        best = None
+        for depth in range(self.depth):
+            children = []
+            for node in beam:
+                if not node.queue:
+                    continue
+                for placement, hold, rest in self.expand(node, spawn_state if depth == 0 else None):
+                    after, lines = apply_placement(node.board, placement)
+                    total = node.lines + lines
+                    children.append(_Node(after, hold, rest, True, total,
+                                          self.evaluate(after, total), node.first or placement))
+            if not children:
+                break
+            children.sort(key=lambda n: n.value, reverse=True)
+            beam = children[:self.beam_width]
+            best = beam[0]
+        return best.first if best is not None else None
+
+    def choose(self, game):
+        piece = game.current_piece
+        hold_shape = game.hold_piece.shape if game.hold_piece is not None else None
+        return self.search(game.board, (piece.shape, game.next_piece.shape), hold_shape,
+                           game.can_hold, (piece.x, piece.y, piece.rotation))
+
+
+def play(game, bot):
+    placement = bot.choose(game)
+    if placement is None:
+        game.step(Action.DROP)
+        return game.tick()
+    if placement.hold:
+        game.step(Action.HOLD)
+    lines = 0
+    for action in placement.path:
+        if action is DOWN:
+            lines += game.tick()
+        else:
+            game.step(action)
+    return lines + game.tick()
@@ -1,6 +1,11 @@
-import socket, threading, pygame, os, sys, json, uuid, random
+import socket, threading, pygame, os, sys, json, uuid, random, argparse
+from collections import deque
 
-from tetris_core import Game, Config, Board
+import wire
+from replay import Recorder
+from profiling import PROFILER
+import gameloop, profiling
+from tetris_core import Game, Config, Board, REDRAW_EVENTS
 
 
 def load_config():
@@ -10,25 +15,80 @@ def load_config():
         return json.load(f)
 
 class NetworkGame(Game):
-    def __init__(self, sock, player_id, player_name, screen):
+    OPPONENT_SCALE = 0.3
+
+    def __init__(self, sock, player_id, player_name, screen, wire_format=wire.JSON, buffered=b"", welcome=None):
         super().__init__()
         self.sock = sock
+        self.wire_format = wire_format
+        self.buffered = buffered
         self.player_id = player_id
         self.player_name = player_name
         self.screen = screen
         self.opponents = {}
+        self.board_seq = 0
+        # On an authoritative server the game runs there; we predict it from the
+        # same seed and only send our inputs, once per gravity tick.
+        self.authoritative = bool(welcome and welcome.get("authoritative"))
+        self.inputs = []
+        # Authoritative garbage and resyncs wait here for the next tick.
+        self.incoming = []
+        self.inbox = deque()
+        if self.authoritative:
+            self.reset(welcome["seed"])
+        else:
+            # Only board deltas read the journal; the authoritative server
+            # never gets one, so there it stays off.
+            self.board.journal = []
         threading.Thread(target=self.receive, daemon=True).start()
 
     def send_board_state(self):
+        with PROFILER.section("send_board_state"):
+            self._send_board_state()
+
+    def _send_board_state(self):
+        keyframe = self.board_seq % wire.KEYFRAME_INTERVAL == 0
         state = {
-            "type": "board",
+            # First, so relays find it within wire.PEEK_LIMIT whatever the name's length.
+            "type": "board" if keyframe else "board_delta",
             "id": self.player_id,
             "name": self.player_name,
             "score": self.score,
-            "locked": list(self.board.locked.items()),
-            "piece": self.current_piece.shape
+            "piece": self.current_piece.shape,
+            "seq": self.board_seq
         }
-        self.sock.sendall((json.dumps(state) + "\n").encode())
+        if keyframe:
+            state["locked"] = list(self.board.locked.items())
+        else:
+            state["ops"] = self.board.journal
+        self.board.journal = []
+        self.board_seq += 1
+        self.send_message(state)
+
+    def send_input(self):
+        msg = {"type": "input", "tick": self.ticks + 1, "actions": self.inputs}
+        self.inputs = []
+        acks = []
+        while self.incoming:
+            event = self.incoming.pop(0)
+            if event["type"] == "resync":
+                self.board = Board({(pos[0], pos[1]): tuple(color) for pos, color in event["locked"]})
+                self.score = event["score"]
+                if self.recorder is not None:
+                    self.recorder.resync(self.ticks, self.score, self.board)
+            else:
+                self.apply_garbage(event["holes"])
+                acks.append(event["gid"])
+        if acks:
+            msg["garbage"] = acks
+        pieces = self.pieces
+        self.tick()
+        if self.pieces != pieces:
+            msg["hash"] = self.board.hash
+        self.send_message(msg)
+
+    def send_message(self, msg):
+        self.sock.sendall(wire.encode(msg, self.wire_format))
 
     def send_garbage(self, target_id, amount):
         state = {
@@ -37,7 +97,7 @@ class NetworkGame(Game):
             "to": target_id,
             "amount": amount
         }
-        self.sock.sendall((json.dumps(state) + "\n").encode())
+        self.send_message(state)
 
     def send_garbage_to_random(self, amount):
         if amount <= 0:
@@ -51,63 +111,123 @@ class NetworkGame(Game):
         self.send_garbage(target, amount)
 
     def receive(self):
-        buffer = ""
+        # Runs on its own thread and only decodes; poll() applies the messages
+        # on the game loop's thread, so nothing the loop touches is shared.
+        frames = wire.FrameBuffer(self.wire_format)
+        pending = self.buffered
 
         while True:
             try:
-                data = self.sock.recv(4096)
+                data = pending or self.sock.recv(65536)
+                pending = b""
                 if not data:
                     break
 
-                buffer += data.decode()
-
-                while "\n" in buffer:
-                    line, buffer = buffer.split("\n", 1)
-                    if not line.strip():
+                for frame in frames.feed(data):
+                    if self.wire_format == wire.JSON and wire.is_blank(frame):
                         continue
-
-                    state = json.loads(line)
-                    msg_type = state.get("type")
-
-                    if msg_type == "board":
-                        pid = state["id"]
-                        if pid != self.player_id:
-                            locked_dict = {
-                                (pos[0], pos[1]): tuple(color)
-                                for pos, color in state["locked"]
-                            }
-                            self.opponents[pid] = {
-                                "name": state["name"],
-                                "score": state["score"],
-                                "locked": locked_dict,
-                                "piece": state["piece"]
-                            }
-
-                    elif msg_type == "garbage":
-                        if state["to"] == self.player_id:
-                            self.board.add_garbage_lines(state["amount"])
+                    with PROFILER.section("receive"):
+                        try:
+                            self.inbox.append(wire.decode(frame, self.wire_format))
+                        except ValueError as e:
+                            # A peer's bad frame is dropped; the stream itself is still in sync.
+                            print("Skipped bad frame:", e)
 
             except Exception as e:
                 print("Receive error:", e)
                 break
 
+    def poll(self):
+        # Called once per frame by the game loop. A peer message that does not
+        # apply is skipped; it must not take the game down with it.
+        inbox = self.inbox
+        while inbox:
+            try:
+                self.handle_message(inbox.popleft())
+            except Exception as e:
+                print("Skipped bad message:", repr(e))
+
+    def handle_message(self, state):
+        msg_type = state.get("type")
+
+        if msg_type == "board":
+            pid = state["id"]
+            if pid != self.player_id:
+                locked_dict = {
+                    (pos[0], pos[1]): tuple(color)
+                    for pos, color in state["locked"]
+                }
+                opp = {
+                    "name": state["name"],
+                    "score": state["score"],
+                    "board": Board(locked_dict),
+                    "piece": state["piece"],
+                    "seq": state.get("seq")
+                }
+                self.renderer.render_opponent(opp, self.OPPONENT_SCALE)
+                self.opponents[pid] = opp
+
+        elif msg_type == "board_delta":
+            pid = state["id"]
+            if pid != self.player_id:
+                self.apply_board_delta(pid, state)
+
+        elif msg_type == "garbage":
+            if state["to"] == self.player_id:
+                if "holes" in state:
+                    self.incoming.append(state)
+                else:
+                    self.queue_garbage(state["amount"])
+
+        elif msg_type == "resync":
+            self.incoming.append(state)
+
+    def apply_board_delta(self, pid, state):
+        name, score, piece, seq = state["name"], state["score"], state["piece"], state["seq"]
+        opp = self.opponents.get(pid)
+        if opp is None:
+            opp = self.opponents[pid] = {"board": Board(), "seq": None}
+        opp["name"] = name
+        opp["score"] = score
+        opp["piece"] = piece
+        # Out of order or missed a delta: keep the stale board until the next keyframe.
+        if opp["seq"] is None or seq != opp["seq"] + 1:
+            opp["seq"] = None
+            return
+        # Ops that fail part way leave the board unknown until the next keyframe too.
+        opp["seq"] = None
+        opp["board"].apply_ops(state["ops"])
+        opp["seq"] = seq
+        self.renderer.render_opponent(opp, self.OPPONENT_SCALE)
+
+    def step(self, action):
+        if self.authoritative:
+            self.inputs.append(action)
+        super().step(action)
+
     def update(self):
-        if self.board.valid_space(self.current_piece, dy=1):
-            self.current_piece.y += 1
-        else:
-            self.board.lock_piece(self.current_piece)
+        if self.authoritative:
+            self.send_input()
+            return
+        pieces = self.pieces
+        lines = self.tick()
+        if self.pieces != pieces:
             self.send_board_state()
-            lines = self.board.clear_lines()
-            self.score += lines * 100
-            garbage = max(0, lines - 1)
-            self.spawn_piece()
-            self.send_garbage_to_random(garbage)
+            self.send_garbage_to_random(max(0, lines - 1))
+
+    def frame_key(self):
+        opponents = tuple((pid, opp["name"], opp["score"], opp["board"], opp["board"].version)
+                          for pid, opp in self.opponents.items())
+        return super().frame_key() + (self.player_name, opponents)
 
     def draw(self):
-        self.screen.fill((0, 0, 0))
+        screen_width, screen_height = self.screen.get_size()
+        Config.update_window_size(screen_width, screen_height)
+        self.renderer.screen = self.screen
+        if not self.renderer.begin(self.frame_key()):
+            return
 
-        grid = self.board.create_grid()
-        self.renderer.draw_grid(grid)
+        self.renderer.draw_board(self.board)
 
         self.renderer.draw_player_info(self.player_name, self.score)
 
@@ -118,16 +238,13 @@ class NetworkGame(Game):
             self.renderer.draw_next_piece(self.next_piece)
             self.renderer.draw_hold_piece(self.hold_piece)
 
-        screen_width, screen_height = self.screen.get_size()
-        Config.update_window_size(screen_width, screen_height)
-
         if len(self.opponents) > 0:
             opponents_list = list(self.opponents.items())
             half = len(opponents_list) // 2
             left_players = opponents_list[:half]
             right_players = opponents_list[half:]
 
-            scale = 0.3
+            scale = self.OPPONENT_SCALE
             block = int(Config.BLOCK_SIZE * scale)
             slot_w = block * Config.COLS
             slot_h = block * Config.ROWS
@@ -139,8 +256,7 @@ class NetworkGame(Game):
             for i, (pid, opp) in enumerate(left_players):
                 slot_x = center_x - slot_w - 50
                 slot_y = center_y + i * (slot_h + margin)
-                opp_grid = Board(opp["locked"]).create_grid()
-                self.renderer.draw_opponent_grid(opp_grid, slot_x, slot_y, scale)
+                self.renderer.draw_opponent_board(opp, slot_x, slot_y, scale)
                 self.renderer.draw_opponent_info(
                     opp["name"], opp["score"], slot_x, slot_y
                 )
@@ -148,13 +264,14 @@ class NetworkGame(Game):
             for i, (pid, opp) in enumerate(right_players):
                 slot_x = center_x + Config.PLAY_W + 50
                 slot_y = center_y + i * (slot_h + margin)
-                opp_grid = Board(opp["locked"]).create_grid()
-                self.renderer.draw_opponent_grid(opp_grid, slot_x, slot_y, scale)
+                self.renderer.draw_opponent_board(opp, slot_x, slot_y, scale)
                 self.renderer.draw_opponent_info(
                     opp["name"], opp["score"], slot_x, slot_y
                 )
 
-        pygame.display.flip()
+        if self.show_profile:
+            self.renderer.draw_overlay(PROFILER.overlay_lines())
+        self.renderer.end()
 
 def get_player_name(screen):
     font = pygame.font.SysFont("consolas", 30)
@@ -196,21 +313,48 @@ def get_player_name(screen):
         pygame.display.flip()
         clock.tick(30)
 
+def negotiate_format(sock, timeout=2.0):
+    # A server that understands "formats" answers the join with a welcome line;
+    # anything else (or silence) means plain JSON. Bytes read past the welcome
+    # belong to the game stream and are handed back.
+    buffer = b""
+    sock.settimeout(timeout)
+    try:
+        while b"\n" not in buffer:
+            data = sock.recv(4096)
+            if not data:
+                break
+            buffer += data
+    except socket.timeout:
+        pass
+    finally:
+        sock.settimeout(None)
+
+    line, sep, rest = buffer.partition(b"\n")
+    if sep:
+        try:
+            msg = json.loads(line)
+        except ValueError:
+            msg = None
+        if isinstance(msg, dict) and msg.get("type") == "welcome":
+            return msg.get("format", wire.JSON), rest, msg
+    return wire.JSON, buffer, None
+
 def main():
+    parser = argparse.ArgumentParser(description="Play on a tetris relay server.")
+    parser.add_argument("--record", help="write a replay log of this game here")
+    gameloop.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    if args.profile:
+        PROFILER.enable(args.profile)
+
     pygame.init()
     config = load_config()
     host = config["HOST"]
     port = config["PORT"]
     room = config["ROOM"]
 
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.connect((host, port))
-    join_msg = {
-        "type": "join",
-        "room": room
-    }
-    sock.sendall((json.dumps(join_msg) + "\n").encode())
-
     info = pygame.display.Info()
     screen_width, screen_height = info.current_w, info.current_h
     screen = pygame.display.set_mode((screen_width / 1.5, screen_height / 1.5), pygame.RESIZABLE)
@@ -219,30 +363,65 @@ def main():
     player_id = str(uuid.uuid4())
     player_name = get_player_name(screen)
 
-    game = NetworkGame(sock, player_id, player_name, screen)
-    game.send_board_state()
-    fall_time = 0
-    fall_speed = 0.8
+    # Connect only once the join is ready: a sharded server routes a
+    # connection on its first frame and waits JOIN_TIMEOUT at most for it.
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect((host, port))
 
-    while True:
-        dt = game.clock.tick(60)/1000
-        fall_time += dt
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit(); sys.exit()
-            elif event.type == pygame.VIDEORESIZE:
-                Config.update_window_size(event.w, event.h)
-                screen = pygame.display.set_mode((event.w, event.h), pygame.RESIZABLE)
-                game.screen = screen
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_ESCAPE:
-                    pygame.quit(); sys.exit()
-                game.handle_input(event)
+    join_msg = {
+        "type": "join",
+        "room": room,
+        "id": player_id,
+        "name": player_name,
+        "formats": list(wire.FORMATS)
+    }
+    sock.sendall((json.dumps(join_msg) + "\n").encode())
 
-        if fall_time >= fall_speed and not game.game_over:
-            fall_time = 0
-            game.update()
-        game.draw()
+    wire_format, buffered, welcome = negotiate_format(sock)
+    game = NetworkGame(sock, player_id, player_name, screen, wire_format, buffered, welcome)
+    if args.record:
+        game.recorder = Recorder(args.record, game.seed)
+    fall_interval = 0.8
+    if game.authoritative:
+        fall_interval = welcome.get("fall_ms", 800) / 1000
+    else:
+        game.send_board_state()
+    loop = gameloop.from_args(game, args, fall_interval)
+
+    try:
+        while True:
+            game.clock.tick(args.fps)
+            PROFILER.tick()
+            with PROFILER.section("poll"):
+                game.poll()
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    pygame.quit(); sys.exit()
+                elif event.type == pygame.VIDEORESIZE:
+                    Config.update_window_size(event.w, event.h)
+                    screen = pygame.display.set_mode((event.w, event.h), pygame.RESIZABLE)
+                    game.screen = screen
+                elif event.type in REDRAW_EVENTS:
+                    game.renderer.invalidate()
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+                    pygame.quit(); sys.exit()
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    game.show_profile = not game.show_profile
+                    # F3 profiles only while the overlay is up; --profile keeps it on throughout.
+                    if game.show_profile:
+                        PROFILER.enable()
+                    elif not args.profile:
+                        PROFILER.disable()
+                elif event.type in (pygame.KEYDOWN, pygame.KEYUP):
+                    loop.handle_event(event)
+
+            with PROFILER.section("update"):
+                loop.frame()
+            with PROFILER.section("draw"):
+                game.draw()
+    finally:
+        if game.recorder is not None:
+            game.recorder.close(game)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,125 @@
+import math, time
+
+from tetris_core import Action, KEY_ACTIONS, pygame
+
+# The simulation advances in fixed steps of 1 / SIM_RATE seconds no matter
+# how often frames are drawn; gravity, auto-repeat and soft drop are all
+# counted in steps, so the same inputs give the same game at any frame rate.
+SIM_RATE = 240
+RENDER_FPS = 60
+# Held left/right start repeating after DAS seconds and then move every ARR
+# seconds (0 slides straight to the wall). Soft drop repeats at its own rate.
+DAS = 0.167
+ARR = 0.033
+SOFT_DROP_RATE = 20
+# A stall longer than this (a dragged window, a debugger) is not caught up on.
+MAX_CATCH_UP = 1.0
+
+MOVES = {Action.LEFT: (-1, 0), Action.RIGHT: (1, 0), Action.SOFT_DROP: (0, 1)}
+OPPOSITE = {Action.LEFT: Action.RIGHT, Action.RIGHT: Action.LEFT}
+
+
+class FixedTimestep:
+    def __init__(self, rate=SIM_RATE, max_catch_up=MAX_CATCH_UP, clock=time.perf_counter):
+        self.rate = rate
+        self.max_catch_up = max_catch_up
+        self.clock = clock
+        self.last = None
+        # Real time not yet simulated, in steps.
+        self.pending = 0.0
+        self.dropped = 0.0
+
+    def due(self):
+        # How many steps to run for the time since the last call.
+        now = self.clock()
+        elapsed = 0.0 if self.last is None else now - self.last
+        self.last = now
+        if elapsed > self.max_catch_up:
+            self.dropped += elapsed - self.max_catch_up
+            elapsed = self.max_catch_up
+        self.pending += elapsed * self.rate
+        steps = int(self.pending + 1e-6)
+        self.pending -= steps
+        return steps
+
+
+class InputRepeater:
+    # Presses are buffered until the next step, so they land between gravity
+    # ticks in the order they were made; held moves then repeat per DAS/ARR.
+    def __init__(self, rate=SIM_RATE, das=DAS, arr=ARR, soft_drop_rate=SOFT_DROP_RATE):
+        self.das = round(das * rate)
+        self.arr = round(arr * rate)
+        self.soft_drop = max(1, round(rate / soft_drop_rate))
+        self.pressed = []
+        # action -> steps until its next repeat
+        self.held = {}
+
+    def press(self, action):
+        self.pressed.append(action)
+        if action in MOVES:
+            # The latest direction wins while both are held.
+            self.held.pop(OPPOSITE.get(action), None)
+            self.held[action] = self.soft_drop if action == Action.SOFT_DROP else self.das
+
+    def release(self, action):
+        self.held.pop(action, None)
+
+    def step(self, game):
+        for action in self.pressed:
+            game.step(action)
+        self.pressed.clear()
+        for action, wait in self.held.items():
+            wait -= 1
+            interval = self.soft_drop if action == Action.SOFT_DROP else self.arr
+            dx, dy = MOVES[action]
+            # Repeats into a wall are not sent, so a held key costs nothing.
+            while wait <= 0 and not game.game_over and game.board.valid_space(game.current_piece, dx=dx, dy=dy):
+                game.step(action)
+                wait += interval
+            self.held[action] = max(wait, 0)
+
+
+class GameLoop:
+    # Feeds key events to the repeater and runs every due step on frame().
+    def __init__(self, game, fall_interval=0.8, rate=SIM_RATE, das=DAS, arr=ARR,
+                 soft_drop_rate=SOFT_DROP_RATE, clock=time.perf_counter):
+        self.game = game
+        self.timestep = FixedTimestep(rate, clock=clock)
+        self.inputs = InputRepeater(rate, das, arr, soft_drop_rate)
+        # Rounded up: gravity must never run ahead of an authoritative server's clock.
+        self.fall_steps = max(1, math.ceil(fall_interval * rate - 1e-9))
+        self.steps = 0
+
+    def handle_event(self, event):
+        action = KEY_ACTIONS.get(event.key)
+        if action is None:
+            return
+        if event.type == pygame.KEYDOWN:
+            self.inputs.press(action)
+        elif event.type == pygame.KEYUP:
+            self.inputs.release(action)
+
+    def frame(self):
+        steps = self.timestep.due()
+        for _ in range(steps):
+            self.step()
+        return steps
+
+    def step(self):
+        game = self.game
+        self.inputs.step(game)
+        self.steps += 1
+        if self.steps % self.fall_steps == 0 and not game.game_over:
+            game.update()
+
+
+def add_arguments(parser):
+    parser.add_argument("--fps", type=int, default=RENDER_FPS, help="frame rate cap for drawing")
+    parser.add_argument("--das-ms", type=float, default=DAS * 1000, help="delay before a held move repeats")
+    parser.add_argument("--arr-ms", type=float, default=ARR * 1000, help="time between repeats (0 = instant)")
+    parser.add_argument("--soft-drop-rate", type=float, default=SOFT_DROP_RATE, help="cells per second")
+
+
+def from_args(game, args, fall_interval=0.8):
+    return GameLoop(game, fall_interval, das=args.das_ms / 1000, arr=args.arr_ms / 1000,
+                    soft_drop_rate=args.soft_drop_rate)
@@ -1,22 +1,48 @@
-from tetris_core import Game
-import pygame, sys
+from tetris_core import Game, REDRAW_EVENTS
+from replay import Recorder
+from profiling import PROFILER
+import gameloop, profiling
+import pygame, sys, argparse
 
 def main():
-    game = Game()
-    fall_time = 0
-    fall_speed = 0.8
-    while True:
-        dt = game.clock.tick(60)/1000
-        fall_time += dt
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit(); sys.exit()
-            if event.type == pygame.KEYDOWN:
-                game.handle_input(event)
-        if fall_time >= fall_speed and not game.game_over:
-            fall_time = 0
-            game.update()
-        game.draw()
+    parser = argparse.ArgumentParser(description="Play tetris locally.")
+    parser.add_argument("--seed", type=int, help="piece sequence seed (random by default)")
+    parser.add_argument("--record", help="write a replay log of this game here")
+    gameloop.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    if args.profile:
+        PROFILER.enable(args.profile)
+
+    game = Game(args.seed)
+    if args.record:
+        game.recorder = Recorder(args.record, game.seed)
+    loop = gameloop.from_args(game, args)
+    try:
+        while True:
+            game.clock.tick(args.fps)
+            PROFILER.tick()
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    pygame.quit(); sys.exit()
+                if event.type in REDRAW_EVENTS:
+                    game.renderer.invalidate()
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    game.show_profile = not game.show_profile
+                    # F3 profiles only while the overlay is up; --profile keeps it on throughout.
+                    if game.show_profile:
+                        PROFILER.enable()
+                    elif not args.profile:
+                        PROFILER.disable()
+                elif event.type in (pygame.KEYDOWN, pygame.KEYUP):
+                    loop.handle_event(event)
+            with PROFILER.section("update"):
+                loop.frame()
+            with PROFILER.section("draw"):
+                game.draw()
+    finally:
+        if game.recorder is not None:
+            game.recorder.close(game)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
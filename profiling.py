@@ -0,0 +1,172 @@
+import json, time
+
+# Histograms keep SUB_BUCKETS buckets per power of two of microseconds, so a
+# percentile is off by at most a quarter of its octave.
+SUB_BUCKETS = 4
+BUCKETS = 32 * SUB_BUCKETS
+# Sections are summarised, shown on the overlay and dumped once per window.
+WINDOW = 1.0
+
+
+def bucket(us):
+    if us < SUB_BUCKETS:
+        return max(0, us)
+    shift = us.bit_length() - 3
+    return min(BUCKETS - 1, (shift + 1) * SUB_BUCKETS + (us >> shift & 3))
+
+
+def bucket_value(index):
+    # Midpoint of a bucket, in microseconds.
+    if index < SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    return ((SUB_BUCKETS + index % SUB_BUCKETS) << shift) + ((1 << shift) - 1) / 2
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, us):
+        self.counts[bucket(us)] += 1
+        self.count += 1
+        self.total += us
+        if us > self.max:
+            self.max = us
+
+    def clear(self):
+        self.counts = [0] * BUCKETS
+        self.count = self.total = self.max = 0
+
+    def percentile(self, p):
+        if not self.count:
+            return 0
+        rank = p * self.count
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bucket_value(index), self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_us": round(self.total / self.count, 1) if self.count else 0,
+            "p50_us": self.percentile(0.5),
+            "p99_us": self.percentile(0.99),
+            "max_us": self.max,
+        }
+
+
+class Section:
+    # Reused for every timing of one name; not safe to share between threads,
+    # so each thread times its own sections.
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.add((time.perf_counter_ns() - self.start) // 1000)
+
+
+class NullSection:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_SECTION = NullSection()
+
+
+class Profiler:
+    # Off until enable(); while off, section() hands out a shared no-op.
+    def __init__(self, window=WINDOW, clock=time.monotonic):
+        self.enabled = False
+        self.window = window
+        self.clock = clock
+        self.histograms = {}
+        self.sections = {}
+        # The last finished window, for the overlay; windows counts them.
+        self.last = {}
+        self.windows = 0
+        self.window_end = None
+        self.dump = None
+
+    def enable(self, dump_path=None):
+        self.enabled = True
+        if self.window_end is None:
+            self.window_end = self.clock() + self.window
+        if dump_path and self.dump is None:
+            self.dump = open(dump_path, "a", encoding="utf-8")
+
+    def disable(self):
+        # Back to the shared no-op; what was timed so far is discarded.
+        self.enabled = False
+        self.window_end = None
+        self.last = {}
+        for histogram in self.histograms.values():
+            histogram.clear()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        return histogram
+
+    def section(self, name):
+        if not self.enabled:
+            return NULL_SECTION
+        section = self.sections.get(name)
+        if section is None:
+            section = self.sections[name] = Section(self.histogram(name))
+        return section
+
+    def summary(self):
+        return {name: histogram.summary() for name, histogram in list(self.histograms.items())}
+
+    def tick(self):
+        # Call once per frame; closes the window when it is due.
+        if not self.enabled or self.clock() < self.window_end:
+            return
+        self.window_end += self.window
+        if self.clock() >= self.window_end:
+            self.window_end = self.clock() + self.window
+        self.last = self.summary()
+        self.windows += 1
+        if self.dump is not None:
+            self.dump.write(json.dumps({"time": round(time.time(), 3), "window": self.window,
+                                        "sections": self.last}) + "\n")
+            self.dump.flush()
+        for histogram in list(self.histograms.values()):
+            histogram.clear()
+
+    def overlay_lines(self):
+        lines = []
+        for name, s in sorted(self.last.items()):
+            lines.append(f"{name:<17}{s['count']:>5}  avg {s['mean_us'] / 1000:6.2f}  "
+                         f"p99 {s['p99_us'] / 1000:6.2f}  max {s['max_us'] / 1000:6.2f} ms")
+        return lines or ["profiling..."]
+
+
+PROFILER = Profiler()
+
+
+def add_arguments(parser):
+    parser.add_argument("--profile", metavar="PATH",
+                        help="time frame phases and append a JSONL summary per second here (F3 shows them)")
@@ -0,0 +1,204 @@
+import argparse, bisect, copy, json, mmap, struct, sys, time
+
+import wire
+from tetris_core import Board, Config, GameState, GEOMETRY
+
+# A replay log is a header followed by records, appended as the game is
+# played. Every record is (kind, tick, payload length) plus the payload, where
+# tick is the number of gravity ticks that had run when it happened, so the
+# log can be read while it is still being written and a torn tail is just
+# ignored. Everything else about the game follows from the seed.
+MAGIC = b"TRPL"
+VERSION = 1
+HEADER = struct.Struct("!4sBBBQ")
+RECORD = struct.Struct("!BIH")
+COUNT = struct.Struct("!H")
+SCORE = struct.Struct("!I")
+END = struct.Struct("!IIIB")
+
+REC_INPUT, REC_GARBAGE, REC_GARBAGE_LINES, REC_HOLES, REC_RESYNC, REC_END = range(6)
+KINDS = ("input", "garbage", "garbage_lines", "holes", "resync", "end")
+
+# Replay keeps a copy of the game every CHECKPOINT_INTERVAL ticks it passes,
+# so seeking only re-simulates from the nearest one.
+CHECKPOINT_INTERVAL = 1000
+# Seconds per gravity tick when a game is played at the default fall speed.
+REAL_TICK = 0.8
+
+
+class Recorder:
+    # Attach to a game with game.recorder = Recorder(path, game.seed), after
+    # any reset(); GameState calls the hooks below as things happen.
+    def __init__(self, path, seed):
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, Config.COLS, Config.ROWS, seed))
+
+    def write(self, kind, tick, payload=b""):
+        self.file.write(RECORD.pack(kind, tick, len(payload)) + payload)
+
+    def input(self, tick, action):
+        self.write(REC_INPUT, tick, bytes((action,)))
+
+    def garbage(self, tick, count):
+        self.write(REC_GARBAGE, tick, COUNT.pack(max(0, count)))
+
+    def garbage_lines(self, tick, count):
+        self.write(REC_GARBAGE_LINES, tick, COUNT.pack(max(0, count)))
+
+    def holes(self, tick, holes):
+        self.write(REC_HOLES, tick, bytes(holes))
+
+    def resync(self, tick, score, board):
+        self.write(REC_RESYNC, tick, SCORE.pack(score) + wire.pack_cells(board.locked.items()))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self, game):
+        # The end record carries the final result Replay.verify() checks against.
+        if self.file.closed:
+            return
+        self.write(REC_END, game.ticks, END.pack(game.score, game.pieces, game.lines, game.game_over))
+        self.file.close()
+
+
+def apply_record(game, kind, payload):
+    if kind == REC_INPUT:
+        game.step(payload[0])
+    elif kind == REC_GARBAGE:
+        game.queue_garbage(COUNT.unpack(payload)[0])
+    elif kind == REC_GARBAGE_LINES:
+        game.add_garbage_lines(COUNT.unpack(payload)[0])
+    elif kind == REC_HOLES:
+        game.apply_garbage(list(payload))
+    elif kind == REC_RESYNC:
+        game.board = Board({(x, y): color for (x, y), color in wire.unpack_cells(payload[SCORE.size:])})
+        game.score = SCORE.unpack_from(payload)[0]
+    else:
+        raise ValueError(f"unknown replay record kind {kind}")
+
+
+def snapshot(game):
+    # The piece geometry tables are shared and never change, so they are not copied.
+    return copy.deepcopy(game, {id(geometry): geometry for geometry in GEOMETRY.values()})
+
+
+class Replay:
+    # Re-simulates a recorded game headlessly from a memory-mapped log.
+    def __init__(self, path, checkpoint_interval=CHECKPOINT_INTERVAL):
+        with open(path, "rb") as f:
+            try:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError(f"{path} is empty") from None
+        if len(self.data) < HEADER.size:
+            raise ValueError(f"{path} is too short for a replay header")
+        magic, version, cols, rows, self.seed = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} replay")
+        if (cols, rows) != (Config.COLS, Config.ROWS):
+            raise ValueError(f"{path} was recorded on a {cols}x{rows} board")
+        self.checkpoint_interval = checkpoint_interval
+        self.counts = dict.fromkeys(KINDS, 0)
+        self.end = None
+        self.last_tick = 0
+        for _, kind, tick, payload in self.records(HEADER.size):
+            name = KINDS[kind] if kind < len(KINDS) else "unknown"
+            self.counts[name] = self.counts.get(name, 0) + 1
+            self.last_tick = tick
+            if kind == REC_END:
+                score, pieces, lines, game_over = END.unpack(payload)
+                self.end = {"ticks": tick, "score": score, "pieces": pieces,
+                            "lines": lines, "game_over": bool(game_over)}
+                break
+        # (tick, offset of the first record not yet applied, game) in tick order.
+        self.checkpoints = [(0, HEADER.size, snapshot(GameState(self.seed)))]
+
+    def close(self):
+        self.data.close()
+
+    def records(self, offset):
+        # Yields (offset, kind, tick, payload); stops at a torn tail.
+        data = self.data
+        size = len(data)
+        while offset + RECORD.size <= size:
+            kind, tick, length = RECORD.unpack_from(data, offset)
+            end = offset + RECORD.size + length
+            if end > size:
+                return
+            yield offset, kind, tick, data[offset + RECORD.size:end]
+            offset = end
+
+    @property
+    def final_tick(self):
+        return self.end["ticks"] if self.end else self.last_tick
+
+    def seek(self, tick):
+        # The game after `tick` gravity ticks, before anything recorded at that tick.
+        return self.run(min(tick, self.final_tick))
+
+    def play(self):
+        # The whole log, including what was recorded after the last tick.
+        return self.run(self.final_tick, through=True)
+
+    def run(self, tick, through=False):
+        i = bisect.bisect_right([t for t, _, _ in self.checkpoints], tick) - 1
+        _, offset, state = self.checkpoints[i]
+        game = snapshot(state)
+        for offset, kind, at, payload in self.records(offset):
+            if kind == REC_END or at > tick or (at == tick and not through):
+                break
+            self.advance(game, at, offset)
+            apply_record(game, kind, payload)
+        else:
+            offset = len(self.data)
+        self.advance(game, tick, offset)
+        return game
+
+    def advance(self, game, tick, offset):
+        # Runs gravity up to `tick`, keeping a checkpoint at every interval
+        # passed for the first time; offset is the next record to apply.
+        interval = self.checkpoint_interval
+        while game.ticks < tick and not game.game_over:
+            game.tick()
+            if game.ticks % interval == 0 and game.ticks > self.checkpoints[-1][0]:
+                self.checkpoints.append((game.ticks, offset, snapshot(game)))
+
+    def verify(self):
+        started = time.perf_counter()
+        game = self.play()
+        elapsed = time.perf_counter() - started
+        result = {"ticks": game.ticks, "score": game.score, "pieces": game.pieces,
+                  "lines": game.lines, "game_over": game.game_over}
+        return {
+            "ok": self.end is not None and result == self.end,
+            "expected": self.end,
+            "replayed": result,
+            "seconds": round(elapsed, 4),
+            "realtime_factor": round(game.ticks * REAL_TICK / elapsed) if elapsed else None,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify or inspect a recorded game.")
+    parser.add_argument("path")
+    parser.add_argument("--seek", type=int, help="print the game state after this many ticks")
+    parser.add_argument("--checkpoint-interval", type=int, default=CHECKPOINT_INTERVAL)
+    args = parser.parse_args()
+
+    replay = Replay(args.path, args.checkpoint_interval)
+    summary = {"seed": replay.seed, "records": replay.counts}
+    summary.update(replay.verify())
+    if args.seek is not None:
+        started = time.perf_counter()
+        game = replay.seek(args.seek)
+        summary["seek"] = {"tick": game.ticks, "score": game.score, "pieces": game.pieces,
+                           "lines": game.lines, "hash": game.board.hash,
+                           "seconds": round(time.perf_counter() - started, 4)}
+    print(json.dumps(summary))
+    replay.close()
+    sys.exit(0 if summary["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
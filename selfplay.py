@@ -0,0 +1,127 @@
+import argparse, json, os, random, sys, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import bot
+from tetris_core import Action, Config, GameState
+
+MAX_PIECES = 100000
+
+
+def random_policy(game, rng):
+    for _ in range(rng.randrange(4)):
+        game.step(Action.ROTATE)
+    shift = rng.randint(-Config.COLS // 2, Config.COLS // 2)
+    for _ in range(abs(shift)):
+        game.step(Action.LEFT if shift < 0 else Action.RIGHT)
+    game.step(Action.DROP)
+    return game.tick()
+
+
+def play_match(match_id, seed, players, policy="random", max_pieces=MAX_PIECES):
+    # Every random stream in the match is derived from the match seed.
+    rng = random.Random(seed)
+    games = [GameState(rng.getrandbits(32)) for _ in range(players)]
+    policy_rngs = [random.Random(rng.getrandbits(32)) for _ in range(players)]
+    player_bot = bot.Bot() if policy == "bot" else None
+    started = time.perf_counter()
+    turns = 0
+
+    while turns < max_pieces * players:
+        alive = [i for i, game in enumerate(games) if not game.game_over]
+        if not alive or (players > 1 and len(alive) == 1):
+            break
+        for i in alive:
+            game = games[i]
+            if player_bot is not None:
+                lines = bot.play(game, player_bot)
+            else:
+                lines = random_policy(game, policy_rngs[i])
+            turns += 1
+            # Same attack rule as NetworkGame.update.
+            garbage = max(0, lines - 1)
+            targets = [j for j in alive if j != i and not games[j].game_over]
+            if garbage and targets:
+                games[rng.choice(targets)].add_garbage_lines(garbage)
+
+    elapsed = time.perf_counter() - started
+    return [
+        {
+            "match": match_id,
+            "player": i,
+            "seed": game.seed,
+            "score": game.score,
+            "lines": game.lines,
+            "pieces": game.pieces,
+            "ticks": game.ticks,
+            "garbage_received": game.garbage_received,
+            "topped_out": game.game_over,
+            "seconds": elapsed,
+        }
+        for i, game in enumerate(games)
+    ]
+
+
+def play_batch(batch, players, policy, max_pieces):
+    return [result for match_id, seed in batch
+            for result in play_match(match_id, seed, players, policy, max_pieces)]
+
+
+def match_seeds(base_seed, matches):
+    rng = random.Random(base_seed)
+    return [rng.getrandbits(32) for _ in range(matches)]
+
+
+def run(matches, players, workers, base_seed, out, chunk=16, policy="random", max_pieces=MAX_PIECES):
+    seeds = list(enumerate(match_seeds(base_seed, matches)))
+    totals = {"games": 0, "score": 0, "lines": 0, "pieces": 0, "ticks": 0}
+    started = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(play_batch, seeds[i:i + chunk], players, policy, max_pieces)
+                   for i in range(0, len(seeds), chunk)]
+        for future in as_completed(futures):
+            for result in future.result():
+                out.write(json.dumps(result) + "\n")
+                totals["games"] += 1
+                for key in ("score", "lines", "pieces", "ticks"):
+                    totals[key] += result[key]
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        "matches": matches,
+        "players": players,
+        "policy": policy,
+        "workers": workers,
+        "seed": base_seed,
+        "seconds": round(elapsed, 3),
+        "games_per_sec": round(totals["games"] / elapsed, 1),
+        "pieces_per_sec": round(totals["pieces"] / elapsed, 1),
+        "ticks_per_sec": round(totals["ticks"] / elapsed, 1),
+        "mean_score": round(totals["score"] / max(1, totals["games"]), 1),
+        "mean_lines": round(totals["lines"] / max(1, totals["games"]), 2),
+    }
+    print(json.dumps(summary), file=sys.stderr)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run headless self-play matches across a process pool.")
+    parser.add_argument("--matches", type=int, default=1000)
+    parser.add_argument("--players", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk", type=int, default=16, help="matches per worker task")
+    parser.add_argument("--policy", choices=("random", "bot"), default="random")
+    parser.add_argument("--max-pieces", type=int, default=MAX_PIECES, help="per player, per match")
+    parser.add_argument("--out", help="write per-game JSONL results here instead of stdout")
+    args = parser.parse_args()
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as out:
+            run(args.matches, args.players, args.workers, args.seed, out, args.chunk, args.policy, args.max_pieces)
+    else:
+        run(args.matches, args.players, args.workers, args.seed, sys.stdout, args.chunk, args.policy, args.max_pieces)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,43 @@ import socket
 import threading
 import json
 import os
+import argparse
+import asyncio
+import bisect
+import hashlib
+import multiprocessing
+import signal
+import struct
+import tempfile
+import time
+from collections import deque
+
+import wire
+from authority import Authority, InputError
+from profiling import Histogram
 
 HOST = "0.0.0.0"
 PORT = os.environ.get("PORT", 50007)
 
+# Per-connection send queue limits. Above SOFT the queue sheds every droppable
+# frame it holds (board keyframes and deltas, never garbage), so a slow peer
+# may show a stale board until the next keyframe gets through; a peer still
+# above HARD after that is disconnected.
+SEND_QUEUE_SOFT = 64 * 1024
+SEND_QUEUE_HARD = 1024 * 1024
+
+# Sharded mode: connections are routed on their first frame, which must fit
+# in one hand-off message; a client that takes longer than JOIN_TIMEOUT to
+# join stays on the worker that accepted it.
+HANDOFF_MAX = 64 * 1024
+JOIN_TIMEOUT = 5.0
+RING_REPLICAS = 64
+
+# With --tick-rate, batching counters are logged this often (seconds).
+STATS_INTERVAL = 10.0
+# With --stats-port, per-room rates are sampled this often (seconds).
+STATS_SAMPLE = 1.0
+
 rooms = {}
 rooms_lock = threading.Lock()
 
@@ -33,42 +66,41 @@ def handle_client(conn, addr):
     print(f"[connect] {addr} connected")
 
     room_id = None
-    buffer = ""
+    frames = wire.FrameBuffer()
 
     while True:
         try:
-            data = conn.recv(4096)
+            data = conn.recv(65536)
             if not data:
                 break
 
-            buffer += data.decode()
-
-            while "\n" in buffer:
-                line, buffer = buffer.split("\n", 1)
-                if not line.strip():
+            for frame in frames.feed(data):
+                if wire.is_blank(frame):
                     continue
 
-                try:
-                    msg = json.loads(line)
-                except json.JSONDecodeError:
-                    print(f"[error] invalid JSON line from {addr}: {line!r}")
-                    continue
+                # Only joins are parsed; everything else is relayed as raw bytes.
+                if wire.peek_type(frame, wire.JSON) == "join":
+                    try:
+                        msg = wire.decode(frame, wire.JSON)
+                    except json.JSONDecodeError:
+                        print(f"[error] invalid JSON line from {addr}: {bytes(frame)!r}")
+                        continue
 
-                if msg.get("type") == "join":
-                    room_id = msg.get("room")
-                    if room_id is None:
-                        print(f"[error] no room specified by {addr}")
+                    if msg.get("type") == "join":
+                        room_id = msg.get("room")
+                        if room_id is None:
+                            print(f"[error] no room specified by {addr}")
+                            continue
+                        with rooms_lock:
+                            rooms.setdefault(room_id, []).append(conn)
+                        print(f"[room] {addr} joined room {room_id}")
                         continue
-                    with rooms_lock:
-                        rooms.setdefault(room_id, []).append(conn)
-                    print(f"[room] {addr} joined room {room_id}")
-                    continue
 
                 if room_id is None:
                     print(f"[warn] {addr} sent message before join")
                     continue
 
-                broadcast_to_room(room_id, line.encode(), sender_conn=conn)
+                broadcast_to_room(room_id, frame, sender_conn=conn)
 
         except ConnectionResetError:
             print(f"[disconnect] {addr} forcibly closed")
@@ -102,11 +134,11 @@ def get_local_ip():
     finally:
         s.close()
 
-def main():
+def run_threaded(host, port):
     local_ip = get_local_ip()
-    print(f"[start] server starting on {local_ip}:{PORT}")
+    print(f"[start] server starting on {local_ip}:{port} (threads)")
 
-    addrinfo = socket.getaddrinfo(HOST, PORT, socket.AF_UNSPEC, socket.SOCK_STREAM)
+    addrinfo = socket.getaddrinfo(host, port, socket.AF_UNSPEC, socket.SOCK_STREAM)
 
     af, socktype, proto, canonname, sa = addrinfo[0]
 
@@ -126,5 +158,649 @@ def main():
 
             threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
 
+class Peer:
+    def __init__(self, writer, addr):
+        self.writer = writer
+        self.transport = writer.transport
+        self.transport.set_write_buffer_limits(high=SEND_QUEUE_SOFT)
+        self.addr = addr
+        self.queue = deque()
+        self.queued_bytes = 0
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.dropped = 0
+        self.format = wire.JSON
+
+    def send(self, frame, droppable=True):
+        if self.closed:
+            return
+        # Fast path: nothing is backed up, hand the frame straight to the transport.
+        if not self.queue and self.transport.get_write_buffer_size() < SEND_QUEUE_SOFT:
+            self.writer.write(frame)
+            return
+        if self.queued_bytes + len(frame) > SEND_QUEUE_SOFT:
+            self.shed()
+            if droppable and self.queued_bytes + len(frame) > SEND_QUEUE_SOFT:
+                self.dropped += 1
+                return
+        if self.queued_bytes + len(frame) > SEND_QUEUE_HARD:
+            print(f"[slow] {self.addr} send queue full, disconnecting")
+            self.close()
+            return
+        self.queue.append((frame, droppable))
+        self.queued_bytes += len(frame)
+        self.ready.set()
+
+    def shed(self):
+        # Queued items can be whole tick batches mixing senders, so this does
+        # not try to keep each sender's newest board; all droppable ones go.
+        kept = deque(item for item in self.queue if not item[1])
+        self.dropped += len(self.queue) - len(kept)
+        self.queue = kept
+        self.queued_bytes = sum(len(frame) for frame, _ in kept)
+
+    async def run_writer(self):
+        try:
+            while not self.closed:
+                await self.ready.wait()
+                self.ready.clear()
+                await self.writer.drain()
+                if not self.queue:
+                    continue
+                batch = b"".join(frame for frame, _ in self.queue)
+                self.queue.clear()
+                self.queued_bytes = 0
+                self.writer.write(batch)
+                await self.writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.ready.set()
+        self.writer.close()
+
+class RelayServer:
+    def __init__(self, owns=None, tick_rate=0, fall_interval=None, stats_port=None, stats_host="127.0.0.1"):
+        self.rooms = {}
+        self.owns = owns
+        self.tick_rate = tick_rate
+        # With a fall interval the server runs every game itself (see authority.py).
+        self.authority = Authority(fall_interval) if fall_interval else None
+        self.pending = {}
+        self.ticker = None
+        # writes: Peer.send calls; unbatched: what one send per frame would have made.
+        self.stats = dict.fromkeys(("frames", "superseded", "writes", "unbatched", "bytes", "bytes_saved"), 0)
+        # room -> [messages in, bytes in, bytes out], and their per-second
+        # rates over the last STATS_SAMPLE.
+        self.room_stats = {}
+        self.room_rates = {}
+        # Microseconds from a frame arriving to it being handed to every
+        # receiver's send queue (including the wait for the tick when batching).
+        self.fanout = Histogram()
+        self.started = time.monotonic()
+        self.stats_port = stats_port
+        self.stats_host = stats_host
+        self.stats_server = None
+
+    def start(self):
+        if self.tick_rate:
+            self.ticker = asyncio.create_task(self.run_ticks())
+        if self.stats_port:
+            self.stats_server = asyncio.create_task(self.serve_stats())
+
+    def count(self, room_id, bytes_in=0, bytes_out=0):
+        counters = self.room_stats.get(room_id)
+        if counters is None:
+            counters = self.room_stats[room_id] = [0, 0, 0]
+        if bytes_in:
+            counters[0] += 1
+            counters[1] += bytes_in
+        counters[2] += bytes_out
+
+    def broadcast(self, room_id, frame, sender=None, droppable=True, msg=None, kind=None, received=None):
+        self.stats["frames"] += 1
+        if received is None:
+            received = time.perf_counter_ns()
+        if self.tick_rate:
+            self.queue(room_id, frame, sender, droppable, msg, kind, received)
+            return
+        sent = 0
+        fmt = sender.format if sender is not None else wire.JSON
+        frames = {fmt: frame}
+        for peer in self.rooms.get(room_id, ()):
+            if peer is sender:
+                continue
+            if peer.format not in frames:
+                # Mixed room: transcode once per format, not once per peer.
+                frames[peer.format] = self.transcode(frame, fmt, msg, peer.format)
+            out = frames[peer.format]
+            if out is None:
+                continue
+            peer.send(out, droppable)
+            sent += len(out)
+            self.stats["writes"] += 1
+            self.stats["unbatched"] += 1
+            self.stats["bytes"] += len(out)
+        self.count(room_id, bytes_out=sent)
+        self.fanout.add((time.perf_counter_ns() - received) // 1000)
+
+    def transcode(self, frame, fmt, msg, target):
+        # A frame that cannot be re-encoded (say a JSON board with a negative
+        # score, which bin1 cannot carry) is dropped for the other format only.
+        try:
+            return wire.encode(msg if msg is not None else wire.decode(frame, fmt), target)
+        except (ValueError, KeyError, TypeError, struct.error) as e:
+            print(f"[error] dropped a {fmt} frame that does not convert to {target}: {e!r}")
+            return None
+
+    def queue(self, room_id, frame, sender, droppable, msg, kind, received):
+        pending = self.pending.setdefault(room_id, [])
+        if kind == "board" and pending:
+            # A keyframe makes this sender's earlier board updates in the tick redundant.
+            kept = [item for item in pending if item[1] is not sender or item[4] not in ("board", "board_delta")]
+            if len(kept) != len(pending):
+                receivers = max(0, len(self.rooms.get(room_id, ())) - 1)
+                self.stats["superseded"] += len(pending) - len(kept)
+                self.stats["bytes_saved"] += receivers * (sum(len(item[0]) for item in pending)
+                                                          - sum(len(item[0]) for item in kept))
+                pending[:] = kept
+        fmt = sender.format if sender is not None else wire.JSON
+        pending.append((frame, sender, droppable, msg, kind, fmt, received))
+
+    def flush(self):
+        pending, self.pending = self.pending, {}
+        for room_id, items in pending.items():
+            encoded = {}
+            for peer in self.rooms.get(room_id, ()):
+                out = []
+                droppable = True
+                for i, (frame, sender, can_drop, msg, kind, fmt, _) in enumerate(items):
+                    if sender is peer:
+                        continue
+                    if fmt != peer.format:
+                        # Mixed room: transcode once per format, not once per peer.
+                        if (i, peer.format) not in encoded:
+                            encoded[i, peer.format] = self.transcode(frame, fmt, msg, peer.format)
+                        frame = encoded[i, peer.format]
+                        if frame is None:
+                            continue
+                    out.append(frame)
+                    droppable = droppable and can_drop
+                if not out:
+                    continue
+                # One write per peer per tick; it is only shed if every frame in it could be.
+                batch = b"".join(out)
+                peer.send(batch, droppable)
+                self.stats["writes"] += 1
+                self.stats["unbatched"] += len(out)
+                self.stats["bytes"] += len(batch)
+                self.count(room_id, bytes_out=len(batch))
+            now = time.perf_counter_ns()
+            for item in items:
+                self.fanout.add((now - item[6]) // 1000)
+
+    async def run_ticks(self):
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.tick_rate
+        deadline = loop.time()
+        report_at = deadline + STATS_INTERVAL
+        last = dict(self.stats)
+        while True:
+            deadline += interval
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
+            try:
+                self.flush()
+            except Exception as e:
+                # One bad tick must not stop batching for every room.
+                print(f"[error] tick flush failed: {e!r}")
+            if loop.time() >= report_at:
+                report_at += STATS_INTERVAL
+                delta = {key: self.stats[key] - last[key] for key in self.stats}
+                last = dict(self.stats)
+                if delta["frames"]:
+                    print(f"[batch] {delta['frames']} frames in, {delta['superseded']} superseded, "
+                          f"{delta['writes']} writes instead of {delta['unbatched']}, "
+                          f"{delta['bytes'] / 1e6:.2f} MB out, {delta['bytes_saved'] / 1e6:.2f} MB saved")
+
+    def snapshot(self):
+        rooms = {}
+        queued, dropped = [], 0
+        for room_id, members in self.rooms.items():
+            depths = [peer.queued_bytes + peer.transport.get_write_buffer_size() for peer in members]
+            queued += depths
+            dropped += sum(peer.dropped for peer in members)
+            messages, bytes_in, bytes_out = self.room_stats.get(room_id, (0, 0, 0))
+            rooms[room_id] = dict(self.room_rates.get(room_id, {}), peers=len(members), messages=messages,
+                                  bytes_in=bytes_in, bytes_out=bytes_out, max_queue_bytes=max(depths, default=0))
+        return {
+            "uptime": round(time.monotonic() - self.started, 1),
+            "totals": self.stats,
+            "rooms": rooms,
+            "send_queue": {"peers": len(queued), "total_bytes": sum(queued),
+                           "max_bytes": max(queued, default=0), "dropped": dropped},
+            "fanout": self.fanout.summary(),
+        }
+
+    async def sample_rates(self):
+        last = {}
+        while True:
+            await asyncio.sleep(STATS_SAMPLE)
+            current = {room_id: list(counters) for room_id, counters in self.room_stats.items()}
+            self.room_rates = {
+                room_id: {name: round((value - before) / STATS_SAMPLE, 1) for name, value, before in
+                          zip(("messages_per_sec", "bytes_in_per_sec", "bytes_out_per_sec"),
+                              counters, last.get(room_id, (0, 0, 0)))}
+                for room_id, counters in current.items()
+            }
+            last = current
+
+    async def serve_stats(self):
+        # A minimal HTTP endpoint: any request line gets the snapshot as JSON.
+        async def respond(reader, writer):
+            try:
+                await asyncio.wait_for(reader.readline(), 2.0)
+                body = json.dumps(self.snapshot()).encode()
+                writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: %d\r\n\r\n" % len(body) + body)
+                await writer.drain()
+            except (asyncio.TimeoutError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        sampler = asyncio.create_task(self.sample_rates())
+        server = await asyncio.start_server(respond, self.stats_host, self.stats_port, reuse_address=True)
+        print(f"[stats] serving on http://{self.stats_host}:{self.stats_port}/")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            sampler.cancel()
+
+    def publish(self, room_id, peer, room_msgs, reply_msgs, received=None):
+        for msg in room_msgs:
+            frame = wire.encode(msg, peer.format)
+            self.broadcast(room_id, frame, sender=peer, droppable=msg["type"] != "garbage",
+                           msg=msg, kind=msg["type"], received=received)
+        for msg in reply_msgs:
+            frame = wire.encode(msg, peer.format)
+            peer.send(frame, False)
+            self.count(room_id, bytes_out=len(frame))
+
+    def leave(self, room_id, peer):
+        members = self.rooms.get(room_id)
+        if members is None:
+            return
+        members.discard(peer)
+        if not members:
+            del self.rooms[room_id]
+            self.room_stats.pop(room_id, None)
+            self.room_rates.pop(room_id, None)
+
+    async def handle(self, reader, writer, buffered=b""):
+        addr = writer.get_extra_info("peername")
+        print(f"[connect] {addr} connected")
+        peer = Peer(writer, addr)
+        writer_task = asyncio.create_task(peer.run_writer())
+        room_id = None
+        player_id = None
+        frames = wire.FrameBuffer()
+
+        try:
+            while not peer.closed:
+                data = buffered or await reader.read(65536)
+                buffered = b""
+                if not data:
+                    break
+
+                pending = deque(frames.feed(data))
+                while pending:
+                    frame = pending.popleft()
+                    if peer.format == wire.JSON and wire.is_blank(frame):
+                        continue
+
+                    # Joins are parsed here, and inputs below when the server runs the
+                    # games; everything else is relayed as raw bytes (peek_type only
+                    # decodes the rare bin1 frames that carry JSON).
+                    kind = wire.peek_type(frame, peer.format)
+                    msg = None
+                    if kind == "join":
+                        try:
+                            msg = wire.decode(frame, peer.format)
+                        except ValueError:
+                            print(f"[error] invalid join from {addr}: {bytes(frame)!r}")
+                            continue
+
+                    if msg is not None and msg.get("type") == "join":
+                        if msg.get("room") is None:
+                            print(f"[error] no room specified by {addr}")
+                            continue
+                        if self.owns is not None and not self.owns(msg["room"]):
+                            # Connections are only handed off before their first join.
+                            print(f"[shard] {addr} switched to room {msg['room']} on another worker, closing")
+                            peer.close()
+                            break
+                        if room_id is not None:
+                            self.leave(room_id, peer)
+                        if player_id is not None:
+                            self.authority.leave(player_id)
+                            player_id = None
+                        room_id = msg["room"]
+                        welcome = None
+                        if wire.BINARY in msg.get("formats", ()) and peer.format == wire.JSON:
+                            welcome = {"type": "welcome", "format": wire.BINARY}
+                        if self.authority is not None:
+                            # player_id is only taken once the join succeeds, so a
+                            # duplicate id never touches the game already using it.
+                            try:
+                                sim, reply, joined = self.authority.join(room_id, str(msg.get("id") or addr),
+                                                                         msg.get("name", ""))
+                            except InputError as e:
+                                print(f"[error] join from {addr} rejected: {e}")
+                                room_id = None
+                                peer.close()
+                                break
+                            player_id = sim.player_id
+                            welcome = dict(welcome or {"type": "welcome", "format": peer.format},
+                                           authoritative=True, seed=sim.game.seed,
+                                           fall_ms=round(self.authority.fall_interval * 1000))
+                        if welcome is not None:
+                            # Acknowledge in JSON; both sides switch formats right after.
+                            peer.send(wire.encode(welcome, wire.JSON), False)
+                            if welcome["format"] != peer.format:
+                                peer.format = welcome["format"]
+                                pending = deque(frames.switch_format(peer.format, pending))
+                        self.rooms.setdefault(room_id, set()).add(peer)
+                        print(f"[room] {addr} joined room {room_id} ({peer.format})")
+                        if player_id is not None:
+                            self.publish(room_id, peer, joined, reply)
+                        continue
+
+                    if room_id is None:
+                        print(f"[warn] {addr} sent message before join")
+                        continue
+                    received = time.perf_counter_ns()
+                    self.count(room_id, bytes_in=len(frame))
+
+                    if self.authority is not None:
+                        # Only inputs are accepted; boards and garbage come from the server's games.
+                        if kind == "input":
+                            self.publish(room_id, peer, *self.authority.handle_input(
+                                player_id, wire.decode(frame, peer.format)), received=received)
+                        continue
+
+                    # Board snapshots supersede each other; garbage must arrive.
+                    self.broadcast(room_id, frame, sender=peer, droppable=kind != "garbage", msg=msg, kind=kind,
+                                   received=received)
+
+        except (ConnectionError, ValueError) as e:
+            print(f"[disconnect] {addr}: {e}")
+
+        finally:
+            if room_id is not None:
+                self.leave(room_id, peer)
+            if player_id is not None:
+                self.authority.leave(player_id)
+            peer.close()
+            await writer_task
+            print(f"[disconnect] {addr} removed from room {room_id}")
+
+async def serve(host, port, **relay_options):
+    relay = RelayServer(**relay_options)
+    relay.start()
+    server = await asyncio.start_server(relay.handle, host, port, reuse_address=True)
+    print("[ready] waiting for connections...")
+    async with server:
+        await server.serve_forever()
+
+def run_asyncio(host, port, **relay_options):
+    local_ip = get_local_ip()
+    print(f"[start] server starting on {local_ip}:{port} (asyncio)")
+    try:
+        asyncio.run(serve(host, port, **relay_options))
+    except KeyboardInterrupt:
+        print("\n[shutdown] server stopped")
+
+def room_hash(key):
+    return int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=8).digest(), "big")
+
+class HashRing:
+    # Consistent hash of room IDs onto workers, so the same room always lands
+    # on the same worker and resizing the pool only moves ~1/N of the rooms.
+    def __init__(self, nodes, replicas=RING_REPLICAS):
+        self.points = sorted((room_hash(f"{node}:{i}"), node) for node in nodes for i in range(replicas))
+        self.keys = [point for point, _ in self.points]
+
+    def owner(self, key):
+        i = bisect.bisect(self.keys, room_hash(key)) % len(self.keys)
+        return self.points[i][1]
+
+def handoff_path(sock_dir, index):
+    return os.path.join(sock_dir, f"worker-{index}.sock")
+
+def reuseport_socket(host, port):
+    af, socktype, proto, canonname, sa = socket.getaddrinfo(host, port, socket.AF_UNSPEC, socket.SOCK_STREAM)[0]
+    sock = socket.socket(af, socktype, proto)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(sa)
+    sock.listen(1024)
+    sock.setblocking(False)
+    return sock
+
+async def open_stream(conn):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    protocol = asyncio.StreamReaderProtocol(reader)
+    transport, _ = await loop.connect_accepted_socket(lambda: protocol, conn)
+    return reader, asyncio.StreamWriter(transport, protocol, reader, loop)
+
+class ShardWorker:
+    # One relay process in sharded mode. Every worker accepts on the shared
+    # SO_REUSEPORT port, reads the join, and passes the socket (plus the bytes
+    # already read) to the worker that owns the room over a unix socket.
+    def __init__(self, index, count, sock_dir, **relay_options):
+        self.index = index
+        self.count = count
+        self.sock_dir = sock_dir
+        self.ring = HashRing(range(count))
+        if relay_options.get("stats_port"):
+            relay_options["stats_port"] += index
+        self.relay = RelayServer(owns=lambda room: self.ring.owner(room) == self.index, **relay_options)
+        self.links = {}
+        self.tasks = set()
+        self.handed_off = 0
+        self.adopted = 0
+
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def serve(self, host, port, barrier):
+        loop = asyncio.get_running_loop()
+        self.relay.start()
+        self.handoff = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.handoff.bind(handoff_path(self.sock_dir, self.index))
+        self.handoff.listen(self.count)
+        self.handoff.setblocking(False)
+        loop.add_reader(self.handoff, self.accept_link)
+
+        # Every hand-off socket must exist before any worker starts accepting.
+        await loop.run_in_executor(None, barrier.wait)
+        listener = reuseport_socket(host, port)
+        print(f"[shard] worker {self.index} ready (pid {os.getpid()})")
+        while True:
+            conn, addr = await loop.sock_accept(listener)
+            conn.setblocking(False)
+            self.spawn(self.route(conn))
+
+    async def route(self, conn):
+        loop = asyncio.get_running_loop()
+        frames = wire.FrameBuffer()
+        data = b""
+        room = None
+        try:
+            while len(data) < HANDOFF_MAX:
+                chunk = await asyncio.wait_for(loop.sock_recv(conn, 4096), JOIN_TIMEOUT)
+                if not chunk:
+                    conn.close()
+                    return
+                data += chunk
+                first = next((f for f in frames.feed(chunk) if not wire.is_blank(f)), None)
+                if first is not None:
+                    if wire.peek_type(first, wire.JSON) == "join":
+                        msg = wire.decode(first, wire.JSON)
+                        room = msg.get("room") if msg.get("type") == "join" else None
+                    break
+        except (asyncio.TimeoutError, ValueError, OSError):
+            pass
+
+        # Anything that is not a routable join is left to the local relay to report.
+        owner = self.index if room is None else self.ring.owner(room)
+        if owner != self.index and len(data) <= HANDOFF_MAX:
+            try:
+                await self.send_handoff(owner, data, conn)
+                self.handed_off += 1
+            except OSError as e:
+                print(f"[shard] hand-off to worker {owner} failed: {e}")
+            conn.close()
+            return
+        await self.adopt(conn, data)
+
+    async def send_handoff(self, owner, data, conn):
+        link = self.links.get(owner)
+        if link is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            sock.connect(handoff_path(self.sock_dir, owner))
+            sock.setblocking(False)
+            link = self.links[owner] = (sock, asyncio.Lock())
+        sock, lock = link
+        loop = asyncio.get_running_loop()
+        async with lock:
+            while True:
+                try:
+                    socket.send_fds(sock, [data], [conn.fileno()])
+                    return
+                except BlockingIOError:
+                    writable = loop.create_future()
+                    loop.add_writer(sock, writable.set_result, None)
+                    try:
+                        await writable
+                    finally:
+                        loop.remove_writer(sock)
+
+    def accept_link(self):
+        try:
+            link, _ = self.handoff.accept()
+        except BlockingIOError:
+            return
+        link.setblocking(False)
+        asyncio.get_running_loop().add_reader(link, self.receive_handoff, link)
+
+    def receive_handoff(self, link):
+        while True:
+            try:
+                data, fds, _, _ = socket.recv_fds(link, HANDOFF_MAX, 1)
+            except BlockingIOError:
+                return
+            except OSError:
+                data, fds = b"", []
+            if not data and not fds:
+                asyncio.get_running_loop().remove_reader(link)
+                link.close()
+                return
+            for fd in fds:
+                conn = socket.socket(fileno=fd)
+                conn.setblocking(False)
+                self.spawn(self.adopt(conn, data))
+
+    async def adopt(self, conn, data):
+        self.adopted += 1
+        try:
+            reader, writer = await open_stream(conn)
+        except OSError:
+            conn.close()
+            return
+        await self.relay.handle(reader, writer, data)
+
+def run_worker(index, count, host, port, sock_dir, barrier, relay_options):
+    worker = ShardWorker(index, count, sock_dir, **relay_options)
+    try:
+        asyncio.run(worker.serve(host, port, barrier))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"[shard] worker {index} stopped: {worker.adopted} connections, "
+              f"{worker.handed_off} handed off")
+
+def run_sharded(host, port, workers, **relay_options):
+    local_ip = get_local_ip()
+    print(f"[start] server starting on {local_ip}:{port} (asyncio, {workers} workers)")
+    # Let a plain kill shut the workers down too.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    with tempfile.TemporaryDirectory(prefix="tetris-relay-") as sock_dir:
+        barrier = multiprocessing.Barrier(workers)
+        procs = [multiprocessing.Process(target=run_worker, args=(i, workers, host, port, sock_dir, barrier, relay_options),
+                                         daemon=True)
+                 for i in range(workers)]
+        for proc in procs:
+            proc.start()
+        try:
+            for proc in procs:
+                proc.join()
+        except KeyboardInterrupt:
+            print("\n[shutdown] server stopped")
+        finally:
+            for proc in procs:
+                proc.terminate()
+            for proc in procs:
+                proc.join()
+
+def main():
+    parser = argparse.ArgumentParser(description="Tetris room relay server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=int(PORT))
+    parser.add_argument("--mode", choices=("asyncio", "threads"), default="asyncio",
+                        help="threads is the old thread-per-connection relay")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="asyncio relay processes sharing the port; rooms are pinned to one worker")
+    parser.add_argument("--tick-rate", type=float, default=0,
+                        help="batch relayed messages and flush them this many times a second (asyncio only)")
+    parser.add_argument("--authoritative", action="store_true",
+                        help="simulate every game on the server; clients only send inputs (asyncio only)")
+    parser.add_argument("--fall-ms", type=int, default=800, help="gravity interval for --authoritative")
+    parser.add_argument("--stats-port", type=int,
+                        help="serve per-room rates, send queues and fan-out latency as JSON over HTTP "
+                             "on this localhost port (worker i of --workers uses port + i; asyncio only)")
+    args = parser.parse_args()
+
+    if args.tick_rate and args.mode != "asyncio":
+        parser.error("--tick-rate needs --mode asyncio")
+    if args.authoritative and args.mode != "asyncio":
+        parser.error("--authoritative needs --mode asyncio")
+    if args.workers > 1 and args.mode != "asyncio":
+        parser.error("--workers needs --mode asyncio")
+    if args.workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        parser.error("--workers needs SO_REUSEPORT")
+    if args.stats_port and args.mode != "asyncio":
+        parser.error("--stats-port needs --mode asyncio")
+
+    relay_options = {"tick_rate": args.tick_rate,
+                     "fall_interval": args.fall_ms / 1000 if args.authoritative else None,
+                     "stats_port": args.stats_port}
+    if args.mode == "threads":
+        run_threaded(args.host, args.port)
+    elif args.workers > 1:
+        run_sharded(args.host, args.port, args.workers, **relay_options)
+    else:
+        run_asyncio(args.host, args.port, **relay_options)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,82 @@
+import random
+
+from tetris_core import Board, Config, GARBAGE_ID, PALETTE
+
+
+def test_garbage_burst_taller_than_board():
+    for count in (Config.ROWS - 1, Config.ROWS, Config.ROWS + 1, 2 * Config.ROWS + 3):
+        board = Board({(x, Config.ROWS - 1): Config.COLORS["T"] for x in range(3)})
+        board.add_garbage_lines(count, random.Random(count))
+        fresh = Board(board.locked)
+        assert board.cols == fresh.cols
+        assert board.rows == fresh.rows
+        assert board.hash == fresh.hash
+
+
+# The dict-based Board from before the bitboard, as the reference for the
+# row operations; holes are passed in so both sides get the same garbage.
+def reference_clear_lines(locked):
+    lines = 0
+    for y in range(Config.ROWS):
+        if all((x, y) in locked for x in range(Config.COLS)):
+            for x in range(Config.COLS):
+                del locked[(x, y)]
+            for (x2, y2) in sorted(list(locked.keys()), key=lambda p: p[1], reverse=True):
+                if y2 < y:
+                    locked[(x2, y2 + 1)] = locked.pop((x2, y2))
+            lines += 1
+    return lines
+
+
+def reference_add_garbage(locked, holes):
+    for hole in holes:
+        for (x, y) in sorted(list(locked.keys()), key=lambda p: p[1]):
+            if y > 0:
+                locked[(x, y - 1)] = locked.pop((x, y))
+        for x in range(Config.COLS):
+            if x != hole:
+                locked[(x, Config.ROWS - 1)] = Config.GARBAGE_COLOR
+
+
+def random_locked(rng):
+    locked = {}
+    colors = list(Config.COLORS.values())
+    for y in range(Config.ROWS - rng.randint(0, Config.ROWS), Config.ROWS):
+        full = rng.random() < 0.3
+        for x in range(Config.COLS):
+            if full or rng.random() < 0.6:
+                locked[(x, y)] = rng.choice(colors)
+    return locked
+
+
+def test_row_operations_match_reference():
+    for trial in range(500):
+        rng = random.Random(trial)
+        locked = random_locked(rng)
+        board = Board(locked)
+        for _ in range(6):
+            if rng.random() < 0.5:
+                assert board.clear_lines() == reference_clear_lines(locked)
+            else:
+                holes = [rng.randrange(Config.COLS) for _ in range(rng.randint(0, Config.ROWS + 5))]
+                board.insert_garbage(holes)
+                reference_add_garbage(locked, holes)
+            assert board.locked == locked, trial
+            fresh = Board(locked)
+            assert board.cols == fresh.cols
+            assert board.hash == fresh.hash
+
+
+def test_add_garbage_lines_uses_rng():
+    board, locked = Board(), {}
+    board.add_garbage_lines(Config.ROWS + 4, random.Random(7))
+    rng = random.Random(7)
+    reference_add_garbage(locked, [rng.randint(0, Config.COLS - 1) for _ in range(Config.ROWS + 4)])
+    assert board.locked == locked
+
+
+def test_unknown_colors_map_to_garbage():
+    for i in range(600):
+        board = Board({(0, 19): (i % 256, i // 256, 7)})
+        assert board.colors[19][0] == GARBAGE_ID
+    assert len(PALETTE) == len(Config.COLORS) + 2
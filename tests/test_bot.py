@@ -0,0 +1,24 @@
+import random
+
+from bot import board_features
+from tetris_core import Board, Config
+
+
+def naive_features(locked):
+    heights, holes = [], 0
+    for x in range(Config.COLS):
+        filled = [y for y in range(Config.ROWS) if (x, y) in locked]
+        heights.append(Config.ROWS - min(filled) if filled else 0)
+        holes += heights[-1] - len(filled)
+    bumpiness = sum(abs(a - b) for a, b in zip(heights, heights[1:]))
+    return sum(heights), holes, bumpiness, max(heights)
+
+
+def test_board_features_match_cell_scan():
+    rng = random.Random(5)
+    for _ in range(300):
+        board = Board({(x, y): Config.GARBAGE_COLOR for y in range(Config.ROWS) for x in range(Config.COLS)
+                       if rng.random() < (y / Config.ROWS) ** 0.7})
+        board.add_garbage_lines(rng.randint(0, 4), rng)
+        board.clear_lines()
+        assert board_features(board) == naive_features(board.locked)
@@ -0,0 +1,60 @@
+import socket
+
+import pygame
+
+import client
+import wire
+from tetris_core import Config
+
+
+def network_game():
+    ours, theirs = socket.socketpair()
+    pygame.init()
+    screen = pygame.display.set_mode((Config.WIDTH, Config.HEIGHT))
+    return client.NetworkGame(ours, "me", "Me", screen), theirs
+
+
+def board(seq, **fields):
+    msg = {"id": "p2", "name": "P2", "score": 0, "piece": "T", "seq": seq, "type": "board",
+           "locked": [[[0, 19], [0, 240, 240]]]}
+    msg.update(fields)
+    return msg
+
+
+def test_bad_peer_messages_are_skipped():
+    game, peer = network_game()
+    try:
+        game.inbox.extend([
+            board(0),
+            {"id": "p2", "type": "board_delta", "score": 5, "piece": "T", "seq": 1, "ops": []},
+            board(0, id="p3", locked=[[[0, 19], "red"], [[1, 19], 7]]),
+            {"id": "p2", "name": "P2", "type": "board_delta", "score": 5, "piece": "T", "seq": 1,
+             "ops": [["lock", "T", [[1, 19]]], ["nonsense"], ["clear"]]},
+            [1, 2],
+            {"type": "garbage", "to": "me", "amount": "two"},
+            board(0, id="p4"),
+        ])
+        game.poll()
+        assert not game.inbox
+        assert set(game.opponents) == {"p2", "p4"}
+        # The delta that failed part way waits for the next keyframe.
+        assert game.opponents["p2"]["seq"] is None
+        assert game.pending_garbage == 0
+        game.draw()
+    finally:
+        peer.close()
+        game.sock.close()
+
+
+def test_board_frames_with_long_names_are_recognised():
+    game, peer = network_game()
+    try:
+        game.player_name = "n" * 1000
+        frames = wire.FrameBuffer()
+        for kind in ("board", "board_delta"):
+            game.send_board_state()
+            (frame,) = frames.feed(peer.recv(65536))
+            assert wire.peek_type(frame, wire.JSON) == kind
+    finally:
+        peer.close()
+        game.sock.close()
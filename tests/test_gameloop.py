@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+import pygame
+
+import gameloop
+from tetris_core import GameState
+
+
+class Headless(GameState):
+    def update(self):
+        self.tick()
+
+
+def run(frame_times, events=None, seed=3, **options):
+    # Frames at the given clock times; events maps a frame index to
+    # (event type, key) pairs handled before that frame.
+    now = [0.0]
+    game = Headless(seed)
+    loop = gameloop.GameLoop(game, 0.8, clock=lambda: now[0], **options)
+    for i, at in enumerate(frame_times):
+        now[0] = at
+        for kind, key in (events or {}).get(i, ()):
+            loop.handle_event(SimpleNamespace(type=kind, key=key))
+        loop.frame()
+    return game, loop
+
+
+def frames(fps, seconds):
+    return [i / fps for i in range(int(seconds * fps) + 1)]
+
+
+def test_gravity_does_not_depend_on_frame_rate():
+    for fps in (10, 60, 144):
+        game, loop = run(frames(fps, 8))
+        assert loop.steps == 8 * gameloop.SIM_RATE
+        assert game.ticks == 10
+
+
+def test_long_stalls_are_not_caught_up():
+    game, loop = run([0.0, 5.0])
+    assert loop.steps == gameloop.SIM_RATE * gameloop.MAX_CATCH_UP
+    assert abs(loop.timestep.dropped - 4.0) < 1e-9
+
+
+def test_held_move_repeats_after_das():
+    held = {1: [(pygame.KEYDOWN, pygame.K_LEFT)]}
+    game, _ = run(frames(60, 0.1), held)
+    assert game.current_piece.x == 2
+    game, _ = run(frames(60, 0.5), held)
+    assert not game.board.valid_space(game.current_piece, dx=-1)
+    game, _ = run(frames(60, 0.5), {**held, 3: [(pygame.KEYUP, pygame.K_LEFT)]})
+    assert game.current_piece.x == 2
+
+
+def test_soft_drop_rate():
+    game, _ = run(frames(60, 0.5), {1: [(pygame.KEYDOWN, pygame.K_s)]})
+    assert 9 <= game.current_piece.y <= 11
+    assert game.score == game.current_piece.y
+
+
+def test_same_inputs_give_the_same_game_at_any_frame_rate():
+    keys = (pygame.K_LEFT, pygame.K_UP, pygame.K_RIGHT, pygame.K_DOWN)
+
+    def play(fps):
+        events = {}
+        for k in range(60):
+            at = round(k * 0.25 * fps)
+            events.setdefault(at, []).append((pygame.KEYDOWN, keys[k % 4]))
+            events.setdefault(at + 1, []).append((pygame.KEYUP, keys[k % 4]))
+        game, _ = run(frames(fps, 15), events)
+        return game.ticks, game.pieces, game.score, game.board.hash
+
+    assert play(60) == play(240) == play(40)
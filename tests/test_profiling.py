@@ -0,0 +1,28 @@
+from profiling import NULL_SECTION, Histogram, Profiler
+
+
+def test_histogram_percentiles_within_a_quarter_octave():
+    histogram = Histogram()
+    for us in range(1, 10001):
+        histogram.add(us)
+    for p in (0.5, 0.9, 0.99):
+        assert abs(histogram.percentile(p) - p * 10000) <= p * 10000 / 4
+    assert histogram.max == 10000 and histogram.percentile(1.0) <= 10000
+
+
+def test_disable_stops_timing():
+    now = [0.0]
+    profiler = Profiler(clock=lambda: now[0])
+    assert profiler.section("draw") is NULL_SECTION
+    profiler.enable()
+    with profiler.section("draw"):
+        pass
+    assert profiler.histograms["draw"].count == 1
+    profiler.disable()
+    assert profiler.section("draw") is NULL_SECTION
+    assert profiler.histograms["draw"].count == 0
+    profiler.tick()
+    profiler.enable()
+    now[0] = 1.5
+    profiler.tick()
+    assert profiler.windows == 1
@@ -0,0 +1,66 @@
+import random
+
+import bot
+import replay
+from tetris_core import Action, GameState
+
+
+def record_game(path, seed=1234, pieces=150):
+    # A bot game with random extra inputs and all three kinds of garbage;
+    # returns (score, board hash, pieces) after every tick.
+    game = GameState(seed)
+    game.recorder = replay.Recorder(path, game.seed)
+    rng = random.Random(5)
+    player = bot.Bot(beam_width=2, depth=1)
+    history = {}
+    while not game.game_over and game.pieces < pieces:
+        for _ in range(rng.randrange(3)):
+            game.step(rng.choice((Action.LEFT, Action.RIGHT, Action.ROTATE, Action.SOFT_DROP)))
+        game.tick()
+        history[game.ticks] = (game.score, game.board.hash, game.pieces)
+        if rng.random() < 0.05:
+            game.queue_garbage(rng.randrange(1, 3))
+        if rng.random() < 0.03:
+            game.apply_garbage([rng.randrange(10)])
+        if rng.random() < 0.02:
+            game.add_garbage_lines(1)
+        if rng.random() < 0.9:
+            bot.play(game, player)
+    return game, history
+
+
+def test_verify_and_seek(tmp_path):
+    path = tmp_path / "game.trpl"
+    game, history = record_game(path)
+    game.recorder.close(game)
+    log = replay.Replay(path, checkpoint_interval=100)
+    result = log.verify()
+    assert result["ok"], result
+    assert result["replayed"]["pieces"] == game.pieces
+    rng = random.Random(1)
+    for tick in sorted(rng.sample(sorted(history), 40), reverse=True):
+        sought = log.seek(tick)
+        assert sought.ticks == tick
+        assert (sought.score, sought.board.hash, sought.pieces) == history[tick], tick
+    assert len(log.checkpoints) > 1
+    log.close()
+
+
+def test_log_is_readable_while_recording_and_after_a_torn_tail(tmp_path):
+    path = tmp_path / "live.trpl"
+    game, history = record_game(path, pieces=40)
+    # Not closed: everything up to the last tick has been flushed.
+    log = replay.Replay(path)
+    assert log.end is None
+    assert log.counts["input"] > 0
+    last = max(tick for tick in history if tick <= log.final_tick)
+    assert log.seek(last).board.hash == history[last][1]
+    log.close()
+
+    game.recorder.close(game)
+    data = path.read_bytes()
+    torn = tmp_path / "torn.trpl"
+    torn.write_bytes(data[:-5])
+    log = replay.Replay(torn)
+    assert log.end is None and not log.verify()["ok"]
+    log.close()
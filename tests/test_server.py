@@ -0,0 +1,51 @@
+import server
+import wire
+
+
+class Peer:
+    def __init__(self, fmt):
+        self.format = fmt
+        self.sent = []
+
+    def send(self, frame, droppable):
+        self.sent.append(bytes(frame))
+
+
+def board(player, score):
+    return {"type": "board", "id": player, "name": player, "score": score, "piece": "T", "seq": 0,
+            "locked": [[[1, 19], [0, 240, 240]]]}
+
+
+def relay(room, msg, sender, relay_server):
+    frame = wire.encode(msg, wire.JSON)
+    relay_server.broadcast(room, frame, sender, True, None, wire.peek_type(frame, wire.JSON))
+
+
+def test_untranscodable_frame_is_dropped_not_fatal():
+    for tick_rate in (30, 0):
+        relay_server = server.RelayServer(tick_rate=tick_rate)
+        a, b, c = Peer(wire.JSON), Peer(wire.BINARY), Peer(wire.BINARY)
+        relay_server.rooms["mixed"] = {a, b}
+        relay_server.rooms["other"] = {c, Peer(wire.JSON)}
+        other = next(peer for peer in relay_server.rooms["other"] if peer is not c)
+        relay("mixed", board("a", -5), a, relay_server)
+        relay("mixed", board("a", 5), a, relay_server)
+        relay("other", board("o", 7), other, relay_server)
+        relay_server.flush()
+        got = [msg for frame in b.sent for msg in wire.FrameBuffer(wire.BINARY).feed(frame)]
+        assert [wire.decode(msg, wire.BINARY)["score"] for msg in got] == [5]
+        assert len(c.sent) == 1
+
+
+def test_hash_ring_is_stable_and_moves_few_rooms():
+    rooms = [f"room-{i}" for i in range(4000)]
+    ring = server.HashRing(range(4))
+    owners = {room: ring.owner(room) for room in rooms}
+    assert owners == {room: server.HashRing(range(4)).owner(room) for room in rooms}
+    counts = [list(owners.values()).count(node) for node in range(4)]
+    assert min(counts) > len(rooms) / 4 * 0.6
+    # A fifth worker takes about a fifth of the rooms, and only from the others.
+    grown = server.HashRing(range(5))
+    moved = [room for room in rooms if grown.owner(room) != owners[room]]
+    assert all(grown.owner(room) == 4 for room in moved)
+    assert 0.1 < len(moved) / len(rooms) < 0.3
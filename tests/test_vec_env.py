@@ -0,0 +1,75 @@
+import random
+
+import numpy as np
+
+from tetris_core import Board, Config, GameState
+from vec_env import SHAPE_NAMES, VecGame
+
+
+def colors(board):
+    return np.array([list(row) for row in board.colors])
+
+
+def test_lockstep_with_game_state():
+    n = 16
+    games = [GameState(seed=i) for i in range(n)]
+    vec = VecGame(n, seed=0)
+
+    def sync_shapes():
+        # The vectorised env draws its own pieces; use the scalar games' ones.
+        for i, game in enumerate(games):
+            vec.shape[i] = SHAPE_NAMES.index(game.current_piece.shape)
+            vec.next_shape[i] = SHAPE_NAMES.index(game.next_piece.shape)
+
+    sync_shapes()
+    rng = random.Random(1)
+    for t in range(600):
+        actions = np.array([rng.randrange(7) for _ in range(n)])
+        for i, game in enumerate(games):
+            if actions[i] < 6:
+                game.step(int(actions[i]))
+        vec.step(np.where(actions < 6, actions, -1))
+        for i, game in enumerate(games):
+            if not game.game_over:
+                piece = game.current_piece
+                assert (piece.x, piece.y, piece.rotation) == (vec.x[i], vec.y[i], vec.rotation[i]), (t, i)
+            hold = -1 if game.hold_piece is None else SHAPE_NAMES.index(game.hold_piece.shape)
+            assert hold == vec.hold_shape[i]
+        sync_shapes()
+        for game in games:
+            if not game.game_over:
+                game.tick()
+        vec.tick()
+        for i, game in enumerate(games):
+            assert game.game_over == vec.game_over[i], (t, i)
+            if not game.game_over:
+                assert game.score == vec.score[i]
+                assert np.array_equal(colors(game.board), vec.boards[i]), (t, i)
+        sync_shapes()
+
+
+def test_garbage_matches_board():
+    for trial in range(50):
+        rng = random.Random(trial)
+        vec = VecGame(8, seed=trial)
+        boards = []
+        for i in range(8):
+            board = Board()
+            for y in range(rng.randint(0, Config.ROWS)):
+                for x in range(Config.COLS):
+                    if rng.random() < 0.5:
+                        board.set_cell(x, Config.ROWS - 1 - y, rng.choice(list(Config.COLORS.values())))
+            boards.append(board)
+            vec.boards[i] = colors(board)
+        counts = np.array([rng.randint(0, Config.ROWS + 2) for _ in range(8)])
+        holes = np.array([[rng.randrange(Config.COLS) for _ in range(max(counts))] for _ in range(8)])
+
+        class FixedHoles:
+            def integers(self, *args, **kwargs):
+                return holes
+
+        vec.rng = FixedHoles()
+        vec.add_garbage_lines(counts)
+        for i, board in enumerate(boards):
+            board.insert_garbage([int(hole) for hole in holes[i][:counts[i]]])
+            assert np.array_equal(colors(board), vec.boards[i]), (trial, i)
@@ -0,0 +1,112 @@
+import random
+
+import pytest
+
+import wire
+from authority import PlayerSim
+from bot import Bot, play
+from tetris_core import Board, GameState
+
+
+def board_msg(name):
+    return {"type": "board", "id": "p1", "name": name, "score": 10, "piece": "T", "seq": 0,
+            "locked": [((0, 19), (255, 0, 0))]}
+
+
+def test_long_name_is_cut_on_a_character_boundary():
+    for name in ("a" + "가" * 90, "가" * 90, "x" * 300):
+        frame = wire.encode(board_msg(name), wire.BINARY)
+        msg = wire.decode(frame, wire.BINARY)
+        assert name.startswith(msg["name"])
+        assert len(msg["name"].encode()) <= 255
+
+
+def test_peek_type_finds_long_joins():
+    join = {"type": "join", "room": "r", "id": "p1", "name": "n" * 2000, "formats": list(wire.FORMATS)}
+    assert wire.peek_type(wire.encode(join, wire.JSON), wire.JSON) == "join"
+
+
+def test_peek_type_finds_server_boards_with_long_names():
+    sim = PlayerSim("p1", "n" * 1000, "r", 7, 0.0)
+    keyframe = sim.board_message()
+    sim.game.tick()
+    delta = sim.board_message()
+    assert wire.peek_type(wire.encode(keyframe, wire.JSON), wire.JSON) == "board"
+    assert wire.peek_type(wire.encode(delta, wire.JSON), wire.JSON) == "board_delta"
+
+
+def test_empty_and_non_object_frames_are_rejected():
+    with pytest.raises(ValueError):
+        wire.FrameBuffer(wire.BINARY).feed(b"\0\0\0\0")
+    for fmt in (wire.JSON, wire.BINARY):
+        frame = wire.encode([1, 2], fmt) if fmt == wire.JSON else (
+            wire.HEADER.pack(4) + bytes((wire.MSG_JSON,)) + b"[1]")
+        with pytest.raises(ValueError):
+            wire.decode(frame, fmt)
+    with pytest.raises(ValueError):
+        wire.peek_type(wire.HEADER.pack(4) + bytes((wire.MSG_JSON,)) + b"[1]", wire.BINARY)
+
+
+def test_board_deltas_round_trip():
+    for fmt in (wire.JSON, wire.BINARY):
+        game = GameState(11)
+        game.board.journal = []
+        mirror = Board()
+        rng = random.Random(2)
+        player = Bot(beam_width=2, depth=1)
+        seq = 0
+        while game.pieces < 40 and not game.game_over:
+            play(game, player)
+            if rng.random() < 0.2:
+                game.add_garbage_lines(rng.randint(1, 3))
+            kind = "board" if seq % wire.KEYFRAME_INTERVAL == 0 else "board_delta"
+            msg = {"type": kind, "id": "p1", "name": "P1", "score": game.score,
+                   "piece": game.current_piece.shape, "seq": seq}
+            if kind == "board":
+                msg["locked"] = list(game.board.locked.items())
+            else:
+                msg["ops"] = game.board.journal
+            game.board.journal = []
+            seq += 1
+            (frame,) = wire.FrameBuffer(fmt).feed(wire.encode(msg, fmt))
+            got = wire.decode(frame, fmt)
+            assert (got["type"], got["seq"], got["score"]) == (kind, msg["seq"], game.score)
+            if kind == "board":
+                mirror = Board({(x, y): tuple(color) for (x, y), color in got["locked"]})
+            else:
+                mirror.apply_ops(got["ops"])
+            assert mirror.rows == game.board.rows, (fmt, seq)
+            assert mirror.locked == game.board.locked, (fmt, seq)
+        assert seq > wire.KEYFRAME_INTERVAL
+
+
+def test_frame_buffer_resplits_random_chunks():
+    rng = random.Random(4)
+    msgs = [{"type": "garbage", "from": f"p{i}", "to": "p0", "amount": i % 5 + 1} for i in range(50)]
+    msgs += [{"type": "board", "id": "p1", "name": "n" * rng.randrange(300), "score": i, "piece": "T",
+              "seq": i, "locked": [[[x, 19], [0, 240, 240]] for x in range(i % 10)]} for i in range(50)]
+    rng.shuffle(msgs)
+    for fmt in (wire.JSON, wire.BINARY):
+        stream = b"".join(wire.encode(msg, fmt) for msg in msgs)
+        for trial in range(20):
+            frames = wire.FrameBuffer(fmt)
+            got = []
+            offset = 0
+            while offset < len(stream):
+                size = rng.choice((1, 2, 3, 7, 64, 1000, 5000))
+                got += [wire.decode(frame, fmt) for frame in frames.feed(stream[offset:offset + size])]
+                offset += size
+            assert got == [wire.decode(frame, fmt) for frame in wire.FrameBuffer(fmt).feed(stream)]
+            assert len(got) == len(msgs) and not frames.pending
+
+
+def test_switch_format_resplits_frames_read_as_json():
+    join = wire.encode({"type": "join", "room": "r", "id": "p1", "formats": list(wire.FORMATS)}, wire.JSON)
+    garbage = [{"type": "garbage", "from": "p1", "to": "p2", "amount": n} for n in (1, 2, 10)]
+    stream = join + b"".join(wire.encode(msg, wire.BINARY) for msg in garbage)
+    for cut in range(len(join), len(stream)):
+        frames = wire.FrameBuffer()
+        first, *rest = frames.feed(stream[:cut])
+        assert wire.decode(first, wire.JSON)["type"] == "join"
+        got = frames.switch_format(wire.BINARY, rest) + frames.feed(stream[cut:])
+        assert [wire.decode(frame, wire.BINARY) for frame in got] == garbage
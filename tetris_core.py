@@ -1,23 +1,49 @@
-import pygame
 import random
+from collections import OrderedDict
 
-class Game:
-    def __init__(self):
-        pygame.init()
-        self.screen = pygame.display.set_mode((Config.WIDTH, Config.HEIGHT), pygame.RESIZABLE)
-        self.clock = pygame.time.Clock()
+from profiling import PROFILER
+
+try:
+    import pygame
+except ImportError:
+    # GameState and Board run headless (server, bots, self-play); only Game and Renderer need pygame.
+    pygame = None
+
+class Action:
+    LEFT, RIGHT, DROP, ROTATE, HOLD, SOFT_DROP = range(6)
+
+class GameState:
+    def __init__(self, seed=None):
+        # When set (see replay.Recorder), inputs and received garbage are logged.
+        self.recorder = None
+        self.reset(seed)
+
+    def reset(self, seed=None):
+        self.seed = random.randrange(1 << 32) if seed is None else seed
+        self.rng = random.Random(self.seed)
+        self.garbage_rng = random.Random(self.seed ^ 0x9E3779B9)
         self.board = Board()
-        self.renderer = Renderer(self.screen)
-        self.current_piece = Piece(random.choice(list(Config.SHAPES.keys())))
-        self.next_piece = Piece(random.choice(list(Config.SHAPES.keys())))
+        self.current_piece = self.random_piece()
+        self.next_piece = self.random_piece()
         self.hold_piece = None
         self.can_hold = True
         self.score = 0
         self.game_over = False
+        self.ticks = 0
+        self.pieces = 0
+        self.lines = 0
+        self.garbage_received = 0
+        # Garbage waiting to rise when the current piece locks.
+        self.pending_garbage = 0
+        self.drop_key = None
+        self.drop = 0
+
+    def random_piece(self):
+        return Piece(self.rng.choice(list(Config.SHAPES.keys())))
 
     def spawn_piece(self):
         self.current_piece = self.next_piece
-        self.next_piece = Piece(random.choice(list(Config.SHAPES.keys())))
+        self.next_piece = self.random_piece()
         self.can_hold = True
         if not self.board.valid_space(self.current_piece):
             self.game_over = True
@@ -33,41 +59,123 @@ class Game:
             self.current_piece.y = 0
         self.can_hold = False
 
-    def get_ghost_cells(self):
-        ghost_y = self.current_piece.y
-        while self.board.valid_space(self.current_piece, dy=(ghost_y - self.current_piece.y + 1)):
-            ghost_y += 1
-        return [(x, y + (ghost_y - self.current_piece.y)) for x,y in self.current_piece.cells()]
+    def drop_distance(self):
+        # Cached until the board or the current piece changes; draw() asks every frame.
+        piece = self.current_piece
+        key = (self.board, self.board.version, piece.shape, piece.x, piece.y, piece.rotation)
+        if key != self.drop_key:
+            self.drop_key = key
+            self.drop = self.board.drop_distance(piece)
+        return self.drop
 
-    def handle_input(self, event):
-        if event.key == pygame.K_LEFT and self.board.valid_space(self.current_piece, dx=-1):
+    def get_ghost_cells(self):
+        return self.current_piece.cells(dy=self.drop_distance())
+
+    def step(self, action):
+        if self.game_over:
+            return
+        if self.recorder is not None:
+            self.recorder.input(self.ticks, action)
+        if action == Action.LEFT and self.board.valid_space(self.current_piece, dx=-1):
             self.current_piece.x -= 1
-        elif event.key == pygame.K_RIGHT and self.board.valid_space(self.current_piece, dx=1):
+        elif action == Action.RIGHT and self.board.valid_space(self.current_piece, dx=1):
             self.current_piece.x += 1
-        elif event.key == pygame.K_DOWN and self.board.valid_space(self.current_piece, dy=1):
-            while self.board.valid_space(self.current_piece, dy=1):
-                self.current_piece.y += 1
-                self.score += 2
-        elif event.key == pygame.K_UP:
+        elif action == Action.DROP and self.drop_distance():
+            distance = self.drop_distance()
+            self.current_piece.y += distance
+            self.score += 2 * distance
+        elif action == Action.SOFT_DROP and self.board.valid_space(self.current_piece, dy=1):
+            self.current_piece.y += 1
+            self.score += 1
+        elif action == Action.ROTATE:
             new_rot = (self.current_piece.rotation+1)%4
             if self.board.valid_space(self.current_piece, rotation=new_rot):
                 self.current_piece.rotation = new_rot
-        elif event.key == pygame.K_c:
+        elif action == Action.HOLD:
             self.hold()
 
-    def update(self):
+    def tick(self):
+        if self.recorder is not None:
+            # Once per gravity tick, so a log being written (or left by a
+            # crash) holds everything up to the last tick.
+            self.recorder.flush()
+        self.ticks += 1
         if self.board.valid_space(self.current_piece, dy=1):
             self.current_piece.y += 1
-        else:
-            self.board.lock_piece(self.current_piece)
-            lines = self.board.clear_lines()
-            self.score += lines * 100
-            self.spawn_piece()
+            return 0
+        self.board.lock_piece(self.current_piece)
+        lines = self.board.clear_lines()
+        self.score += lines * 100
+        self.pieces += 1
+        self.lines += lines
+        if self.pending_garbage:
+            self.garbage_received += self.pending_garbage
+            self.board.add_garbage_lines(self.pending_garbage, self.garbage_rng)
+            self.pending_garbage = 0
+        self.spawn_piece()
+        return lines
+
+    def add_garbage_lines(self, count):
+        if self.recorder is not None:
+            self.recorder.garbage_lines(self.ticks, count)
+        self.garbage_received += max(0, count)
+        self.board.add_garbage_lines(count, self.garbage_rng)
+
+    def queue_garbage(self, count):
+        if self.recorder is not None:
+            self.recorder.garbage(self.ticks, count)
+        self.pending_garbage += max(0, count)
+
+    def apply_garbage(self, holes):
+        # Garbage whose holes were chosen elsewhere (the authoritative server).
+        if self.recorder is not None:
+            self.recorder.holes(self.ticks, holes)
+        self.garbage_received += len(holes)
+        self.board.insert_garbage(holes)
+
+KEY_ACTIONS = {
+    pygame.K_LEFT: Action.LEFT,
+    pygame.K_RIGHT: Action.RIGHT,
+    pygame.K_DOWN: Action.DROP,
+    pygame.K_UP: Action.ROTATE,
+    pygame.K_c: Action.HOLD,
+    pygame.K_s: Action.SOFT_DROP,
+} if pygame is not None else {}
+
+# The window was uncovered or restored and its contents may be gone, so the
+# next frame is drawn in full even if the game did not change.
+REDRAW_EVENTS = {
+    pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED, pygame.WINDOWSHOWN, pygame.WINDOWRESTORED,
+} if pygame is not None else set()
+
+class Game(GameState):
+    def __init__(self, seed=None):
+        super().__init__(seed)
+        pygame.init()
+        self.screen = pygame.display.set_mode((Config.WIDTH, Config.HEIGHT), pygame.RESIZABLE)
+        self.clock = pygame.time.Clock()
+        self.renderer = Renderer(self.screen)
+        # Toggled with F3; draws the profiler's last window over the game.
+        self.show_profile = False
+
+    def update(self):
+        self.tick()
+
+    def frame_key(self):
+        # Everything draw() shows; frames with the same key are skipped.
+        piece = self.current_piece
+        return (self.board, self.board.version, piece.shape, piece.rotation, piece.x, piece.y,
+                self.next_piece.shape, self.hold_piece and self.hold_piece.shape,
+                self.score, self.game_over, Config.BLOCK_SIZE,
+                PROFILER.windows if self.show_profile else None)
 
     def draw(self):
-        self.screen.fill((0,0,0))
-        grid = self.board.create_grid()
-        self.renderer.draw_grid(grid)
+        screen_width, screen_height = self.screen.get_size()
+        Config.update_window_size(screen_width, screen_height)
+        self.renderer.screen = self.screen
+        if not self.renderer.begin(self.frame_key()):
+            return
+        self.renderer.draw_board(self.board)
         self.renderer.draw_player_info("", self.score)
         if not self.game_over:
             ghost_cells = self.get_ghost_cells()
@@ -75,68 +183,97 @@ class Game:
             self.renderer.draw_piece(self.current_piece)
             self.renderer.draw_next_piece(self.next_piece)
             self.renderer.draw_hold_piece(self.hold_piece)
-        screen_width, screen_height = self.screen.get_size()
-        Config.update_window_size(screen_width, screen_height)
-        pygame.display.flip()
+        if self.show_profile:
+            self.renderer.draw_overlay(PROFILER.overlay_lines())
+        self.renderer.end()
 
 class Renderer:
+    # Draws into self.screen between begin() and end(). Cells are blitted from
+    # pre-rendered sprites, the locked cells of the board are cached in one
+    # playfield surface until the board changes, and end() only pushes the
+    # rectangles drawn this frame or the last one to the display.
     def __init__(self, screen):
         self.screen = screen
+        self.fonts = FontCache()
+        self.blocks = {}
+        self.playfield = None
+        self.playfield_key = None
+        self.frame_key = None
+        self.target = None
+        self.rects = []
+        self.dirty = []
+
+    def begin(self, key):
+        # Returns False when nothing on screen would change.
+        target = (self.screen, self.screen.get_size())
+        if key == self.frame_key and target == self.target:
+            return False
+        self.frame_key = key
+        if target != self.target:
+            self.target = target
+            self.screen.fill(Config.EMPTY_COLOR)
+            self.dirty = [self.screen.get_rect()]
+        else:
+            for rect in self.rects:
+                self.screen.fill(Config.EMPTY_COLOR, rect)
+            self.dirty = self.rects
+        self.rects = []
+        return True
 
-    def draw_grid(self, grid):
-        for y in range(Config.ROWS):
-            for x in range(Config.COLS):
-                pygame.draw.rect(
-                    self.screen,
-                    grid[y][x],
-                    ((Config.WIDTH - Config.PLAY_W) // 2 + x * Config.BLOCK_SIZE,
-                     (Config.HEIGHT - Config.PLAY_H) // 2 + y * Config.BLOCK_SIZE,
-                     Config.BLOCK_SIZE,
-                     Config.BLOCK_SIZE),
-                    0
-                )
-                pygame.draw.rect(
-                    self.screen,
-                    [i / 1.25 for i in grid[y][x]],
-                    ((Config.WIDTH - Config.PLAY_W) // 2 + x * Config.BLOCK_SIZE,
-                     (Config.HEIGHT - Config.PLAY_H) // 2 + y * Config.BLOCK_SIZE,
-                     Config.BLOCK_SIZE,
-                     Config.BLOCK_SIZE),
-                    1
-                )
-
-        pygame.draw.rect(
+    def end(self):
+        pygame.display.update(self.dirty + self.rects)
+
+    def invalidate(self):
+        # The next begin() redraws and pushes the whole screen.
+        self.target = None
+
+    def block(self, color, size):
+        sprite = self.blocks.get((color, size))
+        if sprite is None:
+            sprite = pygame.Surface((size, size))
+            sprite.fill(color)
+            pygame.draw.rect(sprite, [i / 1.25 for i in color], sprite.get_rect(), 1)
+            self.blocks[(color, size)] = sprite
+        return sprite
+
+    def render_board(self, board, size, surface=None):
+        if surface is None or surface.get_size() != (Config.COLS * size, Config.ROWS * size):
+            surface = pygame.Surface((Config.COLS * size, Config.ROWS * size))
+        surface.fill(Config.EMPTY_COLOR)
+        cells = []
+        for y, mask in enumerate(board.rows):
+            if mask:
+                colors = board.colors[y]
+                for x in range(Config.COLS):
+                    if mask >> x & 1:
+                        cells.append((self.block(PALETTE[colors[x]], size), (x * size, y * size)))
+        surface.blits(cells, doreturn=False)
+        return surface
+
+    def draw_blocks(self, cells, color, left, top, size):
+        sprite = self.block(color, size)
+        for (x, y) in cells:
+            self.rects.append(self.screen.blit(sprite, (left + x * size, top + y * size)))
+
+    def draw_board(self, board):
+        key = (board, board.version, Config.BLOCK_SIZE)
+        if key != self.playfield_key:
+            self.playfield_key = key
+            self.playfield = self.render_board(board, Config.BLOCK_SIZE, self.playfield)
+        left = (Config.WIDTH - Config.PLAY_W) // 2
+        top = (Config.HEIGHT - Config.PLAY_H) // 2
+        self.rects.append(self.screen.blit(self.playfield, (left, top)))
+        self.rects.append(pygame.draw.rect(
             self.screen,
             (255, 255, 255),
-            ((Config.WIDTH - Config.PLAY_W) // 2 - 3,
-             (Config.HEIGHT - Config.PLAY_H) // 2 - 3,
-             Config.PLAY_W + 6,
-             Config.PLAY_H + 6),
+            (left - 3, top - 3, Config.PLAY_W + 6, Config.PLAY_H + 6),
             3
-        )
+        ))
 
     def draw_piece(self, piece):
-        for (x, y) in piece.cells():
-            if y >= 0:
-                pygame.draw.rect(
-                    self.screen,
-                    piece.color,
-                    (
-                        (Config.WIDTH - Config.PLAY_W) // 2 + x * Config.BLOCK_SIZE,
-                        (Config.HEIGHT - Config.PLAY_H) // 2 + y * Config.BLOCK_SIZE,
-                        Config.BLOCK_SIZE,
-                        Config.BLOCK_SIZE
-                    )
-                )
-                pygame.draw.rect(
-                    self.screen,
-                    [i / 1.25 for i in piece.color],
-                    ((Config.WIDTH - Config.PLAY_W) // 2 + x * Config.BLOCK_SIZE,
-                     (Config.HEIGHT - Config.PLAY_H) // 2 + y * Config.BLOCK_SIZE,
-                     Config.BLOCK_SIZE,
-                     Config.BLOCK_SIZE),
-                    1
-                )
+        self.draw_blocks([(x, y) for x, y in piece.cells() if y >= 0], piece.color,
+                         (Config.WIDTH - Config.PLAY_W) // 2, (Config.HEIGHT - Config.PLAY_H) // 2,
+                         Config.BLOCK_SIZE)
 
     def draw_ghost_piece(self, piece, ghost_cells):
         for (x, y) in ghost_cells:
@@ -146,162 +283,325 @@ class Renderer:
                 Config.BLOCK_SIZE,
                 Config.BLOCK_SIZE
             )
-            pygame.draw.rect(self.screen, piece.color, rect, 1)
+            self.rects.append(pygame.draw.rect(self.screen, piece.color, rect, 1))
 
     def draw_next_piece(self, next_piece):
-        font = pygame.font.SysFont("consolas", 20)
-        label = font.render("Next:", True, (255, 255, 255))
-        self.screen.blit(label, (Config.WIDTH - 150, 50))
+        label = self.fonts.render("Next:", 20)
+        self.rects.append(self.screen.blit(label, (Config.WIDTH - 150, 50)))
         if next_piece:
-            for (x, y) in next_piece.cells():
-                pygame.draw.rect(
-                    self.screen,
-                    next_piece.color,
-                    (
-                        Config.WIDTH - 150 + x * Config.BLOCK_SIZE,
-                        80 + y * Config.BLOCK_SIZE,
-                        Config.BLOCK_SIZE,
-                        Config.BLOCK_SIZE
-                    ),
-                    0
-                )
-                pygame.draw.rect(
-                    self.screen,
-                    [i / 1.25 for i in next_piece.color],
-                    (
-                        Config.WIDTH - 150 + x * Config.BLOCK_SIZE,
-                        80 + y * Config.BLOCK_SIZE,
-                        Config.BLOCK_SIZE,
-                        Config.BLOCK_SIZE
-                    ),
-                    1
-                )
+            self.draw_blocks(next_piece.cells(), next_piece.color, Config.WIDTH - 150, 80, Config.BLOCK_SIZE)
 
     def draw_hold_piece(self, hold_piece):
-        font = pygame.font.SysFont("consolas", 20)
-        label = font.render("Hold:", True, (255, 255, 255))
-        self.screen.blit(label, (50, 50))
+        label = self.fonts.render("Hold:", 20)
+        self.rects.append(self.screen.blit(label, (50, 50)))
         if hold_piece:
-            for (x, y) in hold_piece.cells():
-                pygame.draw.rect(
-                    self.screen,
-                    hold_piece.color,
-                    (
-                        50 + x * Config.BLOCK_SIZE,
-                        80 + y * Config.BLOCK_SIZE,
-                        Config.BLOCK_SIZE,
-                        Config.BLOCK_SIZE
-                    ),
-                    0
-                )
-                pygame.draw.rect(
-                    self.screen,
-                    [i / 1.25 for i in hold_piece.color],
-                    (
-                        50 + x * Config.BLOCK_SIZE,
-                        80 + y * Config.BLOCK_SIZE,
-                        Config.BLOCK_SIZE,
-                        Config.BLOCK_SIZE
-                    ),
-                    1
-                )
+            self.draw_blocks(hold_piece.cells(), hold_piece.color, 50, 80, Config.BLOCK_SIZE)
 
     def draw_player_info(self, name, score):
-        font = pygame.font.SysFont("consolas", 24)
-        text = font.render(f"{name}  Score: {score}", True, (255, 255, 255))
+        text = self.fonts.render(f"{name}  Score: {score}", 24)
         x = Config.WIDTH // 2 - text.get_width() // 2
         y = (Config.HEIGHT - Config.PLAY_H) // 2 - 40
-        self.screen.blit(text, (x, y))
-
-    def draw_opponent_grid(self, grid, x, y, scale=0.3):
+        self.rects.append(self.screen.blit(text, (x, y)))
+
+    def draw_overlay(self, lines):
+        y = Config.HEIGHT - 10 - 16 * len(lines)
+        for line in lines:
+            text = self.fonts.render(line, 14, (255, 255, 0))
+            self.rects.append(self.screen.blit(text, (10, y)))
+            y += 16
+
+    def render_opponent(self, opp, scale=0.3):
+        # Opponent boards are cached per opponent and only re-rendered when the
+        # board object or its version changes; poll() calls this right after
+        # applying an update so draw() normally just blits.
+        board = opp["board"]
+        key = (board, board.version, int(Config.BLOCK_SIZE * scale))
+        cached = opp.get("surface")
+        if cached is None or cached[0] != key:
+            cached = opp["surface"] = (key, self.render_board(board, key[2]))
+        return cached[1]
+
+    def draw_opponent_board(self, opp, x, y, scale=0.3):
         block = int(Config.BLOCK_SIZE * scale)
-        for row in range(Config.ROWS):
-            for col in range(Config.COLS):
-                pygame.draw.rect(
-                    self.screen,
-                    grid[row][col],
-                    (x + col * block, y + row * block, block, block),
-                    0
-                )
-                pygame.draw.rect(
-                    self.screen,
-                    [i / 1.25 for i in grid[row][col]],
-                    (x + col * block, y + row * block, block, block),
-                    1
-                )
-        pygame.draw.rect(
+        self.screen.blit(self.render_opponent(opp, scale), (x, y))
+        self.rects.append(pygame.draw.rect(
             self.screen,
             (200, 200, 200),
             (x, y, Config.COLS * block, Config.ROWS * block),
             2
-        )
+        ))
 
     def draw_opponent_info(self, name, score, x, y):
-        font = pygame.font.SysFont("consolas", 18)
-        text = font.render(f"{name} ({score})", True, (255, 255, 255))
-        self.screen.blit(text, (x, y - 22))
+        text = self.fonts.render(f"{name} ({score})", 18)
+        self.rects.append(self.screen.blit(text, (x, y - 22)))
+
+class FontCache:
+    # SysFont looks the font up and loads it on every call, so fonts are loaded
+    # once per (name, size) and rendered text is kept in a small LRU.
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.fonts = {}
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def font(self, size, name="consolas"):
+        font = self.fonts.get((name, size))
+        if font is None:
+            font = self.fonts[(name, size)] = pygame.font.SysFont(name, size)
+        return font
+
+    def render(self, text, size, color=(255, 255, 255), name="consolas"):
+        key = (text, color, size, name)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+        self.misses += 1
+        surface = self.surfaces[key] = self.font(size, name).render(text, True, color)
+        while len(self.surfaces) > self.max_entries:
+            self.surfaces.popitem(last=False)
+            self.evictions += 1
+        return surface
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "fonts": len(self.fonts),
+            "entries": len(self.surfaces),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
 
 class Board:
     def __init__(self, locked=None):
-        if locked is None:
-            locked = {}
-        self.locked = locked
+        self.rows = [0] * Config.ROWS
+        self.colors = [bytearray(Config.COLS) for _ in range(Config.ROWS)]
+        # The same cells by column: bit y of cols[x] is set when (x, y) is occupied.
+        self.cols = [0] * Config.COLS
+        # Zobrist hash of the occupied cells, kept up to date by every mutation.
+        self.hash = 0
+        # When set to a list, mutations append delta ops to it (see apply_ops).
+        self.journal = None
+        # Bumped by every mutation so renderers can tell when to redraw.
+        self.version = 0
+        if locked:
+            for (x, y), color in locked.items():
+                self.set_cell(x, y, color)
+
+    @property
+    def locked(self):
+        locked = {}
+        for y, mask in enumerate(self.rows):
+            if not mask:
+                continue
+            colors = self.colors[y]
+            for x in range(Config.COLS):
+                if mask >> x & 1:
+                    locked[(x, y)] = PALETTE[colors[x]]
+        return locked
+
+    def copy(self):
+        board = Board.__new__(Board)
+        board.rows = list(self.rows)
+        board.cols = list(self.cols)
+        board.colors = [bytearray(colors) for colors in self.colors]
+        board.hash = self.hash
+        board.journal = None
+        board.version = self.version
+        return board
+
+    def set_cell(self, x, y, color):
+        if 0 <= x < Config.COLS and 0 <= y < Config.ROWS:
+            self.version += 1
+            if not self.rows[y] >> x & 1:
+                self.rows[y] |= 1 << x
+                self.cols[x] |= 1 << y
+                self.hash ^= ZOBRIST[y][x]
+            self.colors[y][x] = color_id(color)
 
     def create_grid(self):
-        grid = [[(0, 0, 0) for _ in range(Config.COLS)] for _ in range(Config.ROWS)]
-        for y in range(Config.ROWS):
-            for x in range(Config.COLS):
-                if (x, y) in self.locked:
-                    grid[y][x] = self.locked[(x, y)]
-        return grid
+        return [[PALETTE[c] for c in colors] for colors in self.colors]
 
     def valid_space(self, piece, rotation=None, dx=0, dy=0):
-        for x,y in piece.cells(rotation, dx, dy):
-            if x < 0 or x >= Config.COLS or y >= Config.ROWS:
-                return False
-            if y >= 0 and self.locked.get((x,y)):
+        geometry = piece.geometry[piece.rotation if rotation is None else rotation]
+        x = piece.x + dx
+        y = piece.y + dy
+        if x + geometry.min_x < 0 or x + geometry.max_x >= Config.COLS or y + geometry.max_y >= Config.ROWS:
+            return False
+        x += geometry.min_x
+        rows = self.rows
+        for cy, mask in geometry.row_masks:
+            if y + cy >= 0 and rows[y + cy] & (mask << x):
                 return False
         return True
 
     def lock_piece(self, piece):
-        for x,y in piece.cells():
+        self.lock_cells(piece.shape, piece.cells())
+
+    def lock_cells(self, shape, cells):
+        cid = color_id(Config.COLORS[shape])
+        self.version += 1
+        for x,y in cells:
             if y >= 0:
-                self.locked[(x,y)] = piece.color
+                if not self.rows[y] >> x & 1:
+                    self.rows[y] |= 1 << x
+                    self.cols[x] |= 1 << y
+                    self.hash ^= ZOBRIST[y][x]
+                self.colors[y][x] = cid
+        if self.journal is not None:
+            self.journal.append(["lock", shape, [[x, y] for x, y in cells if y >= 0]])
 
     def clear_lines(self):
-        lines = 0
-        for y in range(Config.ROWS):
-            if all((x,y) in self.locked for x in range(Config.COLS)):
+        full = [y for y, mask in enumerate(self.rows) if mask == FULL_ROW]
+        if full:
+            self.remove_rows(full)
+        return len(full)
+
+    def remove_rows(self, remove):
+        remove = set(remove)
+        rows, colors = [], []
+        for y, (mask, row_colors) in enumerate(zip(self.rows, self.colors)):
+            if y not in remove:
+                rows.append(mask)
+                colors.append(row_colors)
+        lines = Config.ROWS - len(rows)
+        self.rows = [0] * lines + rows
+        self.colors = [bytearray(Config.COLS) for _ in range(lines)] + colors
+        # In the column masks each removed row's bit goes and the bits above
+        # it move down one; going top to bottom keeps later row numbers valid.
+        for y in sorted(remove):
+            keep = ~((2 << y) - 1)
+            above = (1 << y) - 1
+            self.cols = [col & keep | (col & above) << 1 for col in self.cols]
+        self.version += 1
+        self.rehash()
+        if self.journal is not None:
+            self.journal.append(["clear", sorted(remove)])
+
+    def add_garbage_lines(self, count, rng=random):
+        if count > 0:
+            self.insert_garbage([rng.randint(0, Config.COLS - 1) for _ in range(count)])
+
+    def insert_garbage(self, holes):
+        count = len(holes)
+        garbage = color_id(Config.GARBAGE_COLOR)
+        rows = self.rows + [FULL_ROW & ~(1 << hole) for hole in holes]
+        colors = list(self.colors)
+        for hole in holes:
+            row_colors = bytearray([garbage]) * Config.COLS
+            row_colors[hole] = 0
+            colors.append(row_colors)
+        # Cells pushed past the top stay folded into row 0 (lower rows win),
+        # so a spawn into them still tops out.
+        top, top_colors = rows[count], bytearray(colors[count])
+        for y in range(count - 1, -1, -1):
+            extra = rows[y] & ~top
+            if extra:
                 for x in range(Config.COLS):
-                    del self.locked[(x,y)]
-                for (x2,y2) in sorted(list(self.locked.keys()), key=lambda p:p[1], reverse=True):
-                    if y2 < y:
-                        self.locked[(x2,y2+1)] = self.locked.pop((x2,y2))
-                lines += 1
-        return lines
-
-    def add_garbage_lines(self, count):
-        for _ in range(count):
-            for (x, y) in sorted(list(self.locked.keys()), key=lambda p: p[1]):
-                if y > 0:
-                    self.locked[(x, y - 1)] = self.locked.pop((x, y))
-            hole = random.randint(0, Config.COLS - 1)
-            for x in range(Config.COLS):
-                if x != hole:
-                    self.locked[(x, Config.ROWS - 1)] = (100, 100, 100)
+                    if extra >> x & 1:
+                        top_colors[x] = colors[y][x]
+                top |= extra
+        self.rows = [top] + rows[count + 1:]
+        self.colors = [top_colors] + colors[count + 1:]
+        # Columns shift up by count (folding into row 0 like the rows do) and
+        # gain the garbage rows at the bottom, minus each row's hole. A burst
+        # of a whole board or more replaces every row, so they are rebuilt.
+        if count < Config.ROWS:
+            pushed = (1 << count) - 1
+            added = [pushed << (Config.ROWS - count)] * Config.COLS
+            for i, hole in enumerate(holes):
+                added[hole] &= ~(1 << (Config.ROWS - count + i))
+            self.cols = [col >> count | (1 if col & pushed else 0) | bits for col, bits in zip(self.cols, added)]
+        else:
+            self.cols = [sum(1 << y for y, mask in enumerate(self.rows) if mask >> x & 1)
+                         for x in range(Config.COLS)]
+        self.version += 1
+        self.rehash()
+        if self.journal is not None:
+            self.journal.append(["garbage", list(holes)])
+
+    def apply_ops(self, ops):
+        for op in ops:
+            if op[0] == "lock":
+                self.lock_cells(op[1], op[2])
+            elif op[0] == "clear":
+                self.remove_rows(op[1])
+            elif op[0] == "garbage":
+                self.insert_garbage(op[1])
+
+    def rehash(self):
+        h = 0
+        for y, mask in enumerate(self.rows):
+            if mask:
+                h ^= ROW_HASH[y][mask]
+        self.hash = h
+
+    def drop_distance(self, piece):
+        # Rows the piece can fall: in each column it covers, the gap between
+        # its lowest cell and the first occupied cell below (or the floor).
+        # Looking below the piece rather than at column heights keeps this
+        # right under overhangs.
+        geometry = piece.geometry[piece.rotation]
+        distance = Config.ROWS
+        for cx, cy in geometry.bottoms:
+            y = piece.y + cy
+            mask = self.cols[piece.x + cx]
+            below = mask >> (y + 1) if y >= -1 else mask << (-1 - y)
+            gap = (below & -below).bit_length() - 1 if below else Config.ROWS - 1 - y
+            if gap < distance:
+                distance = gap
+        return distance
+
+    def heights(self):
+        # Height of the topmost occupied cell per column, 0 for an empty column.
+        return [Config.ROWS - (mask & -mask).bit_length() + 1 if mask else 0 for mask in self.cols]
 
 class Piece:
+    __slots__ = ("shape", "rotation", "color", "x", "y", "geometry")
+
     def __init__(self, shape):
         self.shape = shape
         self.rotation = 0
         self.color = Config.COLORS[shape]
         self.x = Config.COLS // 2 - 2
         self.y = 0
+        self.geometry = GEOMETRY[shape]
 
     def cells(self, rotation = None, dx = 0, dy = 0):
         rot = self.rotation if rotation is None else rotation
-        return [(self.x + cx + dx, self.y + cy + dy)
-                for cx, cy in Config.SHAPES[self.shape][rot]]
+        return self.geometry[rot].cells_at(self.x + dx, self.y + dy)
+
+class Geometry:
+    __slots__ = ("offsets", "min_x", "max_x", "min_y", "max_y", "row_masks", "bottoms", "_placed")
+
+    def __init__(self, offsets):
+        self.offsets = tuple(offsets)
+        self.min_x = min(cx for cx, _ in self.offsets)
+        self.max_x = max(cx for cx, _ in self.offsets)
+        self.min_y = min(cy for _, cy in self.offsets)
+        self.max_y = max(cy for _, cy in self.offsets)
+        # One (cy, mask) pair per occupied row; bit 0 of mask is column min_x.
+        self.row_masks = tuple(
+            (cy, sum(1 << (cx - self.min_x) for cx, y in self.offsets if y == cy))
+            for cy in sorted({cy for _, cy in self.offsets})
+        )
+        # (cx, lowest cy) per occupied column, for Board.drop_distance.
+        self.bottoms = tuple(
+            (cx, max(cy for x, cy in self.offsets if x == cx))
+            for cx in sorted({cx for cx, _ in self.offsets})
+        )
+        self._placed = {}
+
+    def cells_at(self, x, y):
+        cells = self._placed.get((x, y))
+        if cells is None:
+            cells = self._placed[(x, y)] = tuple((x + cx, y + cy) for cx, cy in self.offsets)
+        return cells
 
 class Config:
     BLOCK_SIZE = 20
@@ -313,6 +613,9 @@ class Config:
 
     WIDTH, HEIGHT = 800, 600
 
+    EMPTY_COLOR = (0, 0, 0)
+    GARBAGE_COLOR = (100, 100, 100)
+
     @classmethod
     def update_window_size(cls, width, height):
         cls.WIDTH, cls.HEIGHT = width, height
@@ -348,3 +651,30 @@ class Config:
         'L': [[(2, 0), (0, 1), (1, 1), (2, 1)], [(1, 0), (1, 1), (1, 2), (2, 2)],
               [(0, 1), (1, 1), (2, 1), (0, 2)], [(0, 0), (1, 0), (1, 1), (1, 2)]]
     }
+
+FULL_ROW = (1 << Config.COLS) - 1
+
+def _row_hashes(keys):
+    table = [0] * (FULL_ROW + 1)
+    for mask in range(1, FULL_ROW + 1):
+        low = mask & -mask
+        table[mask] = table[mask ^ low] ^ keys[low.bit_length() - 1]
+    return table
+
+_zobrist_rng = random.Random(0x5A0B)
+ZOBRIST = [[_zobrist_rng.getrandbits(64) for _ in range(Config.COLS)] for _ in range(Config.ROWS)]
+# ROW_HASH[y][mask] is the XOR of ZOBRIST[y][x] over the bits of mask.
+ROW_HASH = [_row_hashes(keys) for keys in ZOBRIST]
+
+GEOMETRY = {shape: tuple(Geometry(offsets) for offsets in rotations)
+            for shape, rotations in Config.SHAPES.items()}
+
+# Board.colors stores one byte per cell indexing into PALETTE; 0 is empty.
+# The palette is fixed: colors from elsewhere (a peer's board) that are not
+# in it are drawn as garbage rather than added, so it cannot grow.
+PALETTE = (Config.EMPTY_COLOR, *Config.COLORS.values(), Config.GARBAGE_COLOR)
+COLOR_IDS = {color: i for i, color in enumerate(PALETTE)}
+GARBAGE_ID = COLOR_IDS[Config.GARBAGE_COLOR]
+
+def color_id(color):
+    return COLOR_IDS.get(tuple(color), GARBAGE_ID)
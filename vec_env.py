@@ -0,0 +1,171 @@
+import numpy as np
+
+from tetris_core import Action, Config, color_id
+
+SHAPE_NAMES = list(Config.SHAPES.keys())
+# OFFSETS[shape, rotation, cell] -> (cx, cy), same tables as Piece uses.
+OFFSETS = np.array([Config.SHAPES[shape] for shape in SHAPE_NAMES], dtype=np.int64)
+SHAPE_COLORS = np.array([color_id(Config.COLORS[shape]) for shape in SHAPE_NAMES], dtype=np.uint8)
+GARBAGE = color_id(Config.GARBAGE_COLOR)
+
+
+class VecGame:
+    def __init__(self, n, seed=None):
+        self.n = n
+        self.rng = np.random.default_rng(seed)
+        self.env = np.arange(n)
+        self.boards = np.zeros((n, Config.ROWS, Config.COLS), dtype=np.uint8)
+        self.shape = np.zeros(n, dtype=np.int64)
+        self.next_shape = np.zeros(n, dtype=np.int64)
+        self.hold_shape = np.zeros(n, dtype=np.int64)
+        self.can_hold = np.zeros(n, dtype=bool)
+        self.rotation = np.zeros(n, dtype=np.int64)
+        self.x = np.zeros(n, dtype=np.int64)
+        self.y = np.zeros(n, dtype=np.int64)
+        self.score = np.zeros(n, dtype=np.int64)
+        self.lines = np.zeros(n, dtype=np.int64)
+        self.game_over = np.zeros(n, dtype=bool)
+        self.reset()
+
+    def reset(self, mask=None):
+        if mask is None:
+            mask = np.ones(self.n, dtype=bool)
+        count = int(mask.sum())
+        self.boards[mask] = 0
+        self.shape[mask] = self.rng.integers(0, len(SHAPE_NAMES), count)
+        self.next_shape[mask] = self.rng.integers(0, len(SHAPE_NAMES), count)
+        self.hold_shape[mask] = -1
+        self.can_hold[mask] = True
+        self.score[mask] = 0
+        self.lines[mask] = 0
+        self.game_over[mask] = False
+        self.place_at_spawn(mask)
+
+    def place_at_spawn(self, mask):
+        self.rotation[mask] = 0
+        self.x[mask] = Config.COLS // 2 - 2
+        self.y[mask] = 0
+
+    def cells(self, rotation=None, dx=0, dy=0):
+        rot = self.rotation if rotation is None else rotation
+        offsets = OFFSETS[self.shape, rot]
+        xs = (self.x + dx)[:, None] + offsets[:, :, 0]
+        ys = (self.y + dy)[:, None] + offsets[:, :, 1]
+        return xs, ys
+
+    def valid_space(self, rotation=None, dx=0, dy=0):
+        xs, ys = self.cells(rotation, dx, dy)
+        inside = (xs >= 0) & (xs < Config.COLS) & (ys < Config.ROWS)
+        occupied = self.boards[
+            self.env[:, None],
+            np.clip(ys, 0, Config.ROWS - 1),
+            np.clip(xs, 0, Config.COLS - 1),
+        ] != 0
+        return inside.all(axis=1) & ~(occupied & (ys >= 0)).any(axis=1)
+
+    def drop_distance(self, mask):
+        distance = np.zeros(self.n, dtype=np.int64)
+        active = mask.copy()
+        for d in range(1, Config.ROWS + 1):
+            active &= self.valid_space(dy=d)
+            if not active.any():
+                break
+            distance[active] = d
+        return distance
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        live = ~self.game_over
+
+        move = live & (actions == Action.LEFT) & self.valid_space(dx=-1)
+        self.x[move] -= 1
+        move = live & (actions == Action.RIGHT) & self.valid_space(dx=1)
+        self.x[move] += 1
+
+        new_rot = (self.rotation + 1) % 4
+        move = live & (actions == Action.ROTATE) & self.valid_space(rotation=new_rot)
+        self.rotation[move] = new_rot[move]
+
+        move = live & (actions == Action.SOFT_DROP) & self.valid_space(dy=1)
+        self.y[move] += 1
+        self.score[move] += 1
+
+        drop = live & (actions == Action.DROP)
+        if drop.any():
+            distance = self.drop_distance(drop)
+            self.y += distance
+            self.score += 2 * distance
+
+        hold = live & (actions == Action.HOLD) & self.can_hold
+        if hold.any():
+            empty = hold & (self.hold_shape < 0)
+            swap = hold & ~empty
+            self.hold_shape[empty] = self.shape[empty]
+            self.spawn(empty)
+            self.shape[swap], self.hold_shape[swap] = self.hold_shape[swap], self.shape[swap]
+            self.place_at_spawn(swap)
+            self.can_hold[hold] = False
+
+    def tick(self):
+        live = ~self.game_over
+        fall = live & self.valid_space(dy=1)
+        self.y[fall] += 1
+        return self.lock(live & ~fall)
+
+    def lock(self, mask):
+        lines = np.zeros(self.n, dtype=np.int64)
+        if not mask.any():
+            return lines
+        xs, ys = self.cells()
+        put = mask[:, None] & (ys >= 0)
+        env = np.broadcast_to(self.env[:, None], xs.shape)
+        colors = np.broadcast_to(SHAPE_COLORS[self.shape][:, None], xs.shape)
+        self.boards[env[put], ys[put], xs[put]] = colors[put]
+        lines = self.clear_lines()
+        self.score += lines * 100
+        self.lines += lines
+        self.spawn(mask)
+        return lines
+
+    def clear_lines(self):
+        full = (self.boards != 0).all(axis=2)
+        lines = full.sum(axis=1)
+        if lines.any():
+            # Stable sort moves full rows to the top and keeps the rest in order.
+            order = np.argsort(~full, axis=1, kind="stable")
+            self.boards = np.take_along_axis(self.boards, order[:, :, None], axis=1)
+            self.boards[np.arange(Config.ROWS)[None, :] < lines[:, None]] = 0
+        return lines
+
+    def spawn(self, mask):
+        count = int(mask.sum())
+        if not count:
+            return
+        self.shape[mask] = self.next_shape[mask]
+        self.next_shape[mask] = self.rng.integers(0, len(SHAPE_NAMES), count)
+        self.place_at_spawn(mask)
+        self.can_hold[mask] = True
+        self.game_over |= mask & ~self.valid_space()
+
+    def add_garbage_lines(self, counts):
+        counts = np.broadcast_to(np.asarray(counts, dtype=np.int64), (self.n,))
+        most = int(counts.max())
+        if most <= 0:
+            return
+        counts = np.maximum(counts, 0)
+        garbage = np.full((self.n, most, Config.COLS), GARBAGE, dtype=np.uint8)
+        holes = self.rng.integers(0, Config.COLS, (self.n, most))
+        garbage[self.env[:, None], np.arange(most)[None, :], holes] = 0
+        stack = np.concatenate([self.boards, garbage], axis=1)
+
+        # Same rule as Board.insert_garbage: cells pushed past the top are
+        # folded into row 0, lower rows winning.
+        height = np.arange(Config.ROWS + most)[None, :, None]
+        pushed = (height <= counts[:, None, None]) & (stack != 0)
+        source = np.where(pushed, height, -1).max(axis=1)
+        top = np.take_along_axis(stack, np.maximum(source, 0)[:, None, :], axis=1)[:, 0]
+        top[source < 0] = 0
+
+        rows = np.arange(Config.ROWS)[None, :] + counts[:, None]
+        self.boards = np.take_along_axis(stack, rows[:, :, None], axis=1)
+        self.boards[:, 0] = top
@@ -0,0 +1,268 @@
+import json
+import struct
+
+from tetris_core import Config, GARBAGE_ID, PALETTE, color_id
+
+# Wire formats a client can ask for in its join message. JSON is the original
+# newline-delimited text protocol and is what every peer falls back to.
+JSON = "json"
+BINARY = "bin1"
+FORMATS = (BINARY, JSON)
+
+# Binary frames are a 4-byte big-endian length followed by the payload; the
+# first payload byte is the message kind.
+HEADER = struct.Struct("!I")
+MAX_FRAME = 1 << 20
+PEEK_LIMIT = 512
+# Every KEYFRAME_INTERVAL-th board update a player sends is a full snapshot,
+# so peers that joined late or missed a delta can resync.
+KEYFRAME_INTERVAL = 10
+
+MSG_JSON, MSG_BOARD, MSG_BOARD_DELTA, MSG_GARBAGE = range(4)
+OP_LOCK, OP_CLEAR, OP_GARBAGE = range(3)
+OP_NAMES = {"lock": OP_LOCK, "clear": OP_CLEAR, "garbage": OP_GARBAGE}
+
+SHAPES = list(Config.SHAPES.keys())
+# Piece ids double as palette ids: 0 empty, 1-7 the shapes, 8 garbage.
+PIECE_IDS = {shape: i + 1 for i, shape in enumerate(SHAPES)}
+CELLS = Config.ROWS * Config.COLS
+
+BOARD_HEAD = struct.Struct("!BIIB")
+GARBAGE_HEAD = struct.Struct("!BB")
+
+
+def encode(msg, fmt):
+    if fmt == BINARY:
+        return encode_binary(msg)
+    return (json.dumps(msg) + "\n").encode()
+
+
+def decode(frame, fmt):
+    if fmt == BINARY:
+        msg = decode_binary(memoryview(frame)[HEADER.size:])
+    else:
+        msg = json.loads(bytes(frame))
+    if not isinstance(msg, dict):
+        raise ValueError(f"message is a {type(msg).__name__}, not an object")
+    return msg
+
+
+def _pack_str(text):
+    # Cut to 255 bytes on a character boundary, so the receiver can decode it.
+    data = text.encode()[:255].decode("utf-8", "ignore").encode()
+    return bytes((len(data),)) + data
+
+
+def _unpack_str(payload, offset):
+    length = payload[offset]
+    end = offset + 1 + length
+    return bytes(payload[offset + 1:end]).decode(), end
+
+
+def pack_cells(locked):
+    cells = bytearray(CELLS)
+    for (x, y), color in locked:
+        if 0 <= x < Config.COLS and 0 <= y < Config.ROWS:
+            cells[y * Config.COLS + x] = color_id(color)
+    return bytes(map(lambda hi, lo: hi << 4 | lo, cells[0::2], cells[1::2]))
+
+
+def unpack_cells(packed):
+    locked = []
+    cols = Config.COLS
+    for i, byte in enumerate(packed):
+        if not byte:
+            continue
+        if byte >> 4:
+            locked.append([[2 * i % cols, 2 * i // cols], PALETTE[byte >> 4]])
+        if byte & 15:
+            locked.append([[(2 * i + 1) % cols, (2 * i + 1) // cols], PALETTE[byte & 15]])
+    return locked
+
+
+def _pack_ops(ops):
+    out = bytearray((len(ops),))
+    for op in ops:
+        kind = OP_NAMES[op[0]]
+        out.append(kind)
+        if kind == OP_LOCK:
+            out.append(PIECE_IDS[op[1]])
+            out.append(len(op[2]))
+            out.extend(y * Config.COLS + x for x, y in op[2])
+        else:
+            out.append(len(op[1]))
+            out.extend(op[1])
+    return bytes(out)
+
+
+def _unpack_ops(payload, offset):
+    ops = []
+    count = payload[offset]
+    offset += 1
+    for _ in range(count):
+        kind = payload[offset]
+        if kind == OP_LOCK:
+            shape = SHAPES[payload[offset + 1] - 1]
+            n = payload[offset + 2]
+            cells = [[c % Config.COLS, c // Config.COLS] for c in payload[offset + 3:offset + 3 + n]]
+            ops.append(["lock", shape, cells])
+            offset += 3 + n
+        else:
+            n = payload[offset + 1]
+            values = list(payload[offset + 2:offset + 2 + n])
+            ops.append(["clear" if kind == OP_CLEAR else "garbage", values])
+            offset += 2 + n
+    return ops, offset
+
+
+def encode_binary(msg):
+    kind = msg.get("type")
+    if kind in ("board", "board_delta"):
+        code = MSG_BOARD if kind == "board" else MSG_BOARD_DELTA
+        payload = [
+            BOARD_HEAD.pack(code, msg["score"], msg.get("seq", 0), PIECE_IDS[msg["piece"]]),
+            _pack_str(msg["id"]),
+            _pack_str(msg["name"]),
+        ]
+        if code == MSG_BOARD:
+            payload.append(pack_cells(msg["locked"]))
+        else:
+            payload.append(_pack_ops(msg["ops"]))
+        payload = b"".join(payload)
+    elif kind == "garbage" and "holes" not in msg:
+        payload = b"".join((
+            GARBAGE_HEAD.pack(MSG_GARBAGE, min(msg["amount"], 255)),
+            _pack_str(msg["from"]),
+            _pack_str(msg["to"]),
+        ))
+    else:
+        payload = bytes((MSG_JSON,)) + json.dumps(msg).encode()
+    return HEADER.pack(len(payload)) + payload
+
+
+def decode_binary(payload):
+    try:
+        code = payload[0]
+        if code in (MSG_BOARD, MSG_BOARD_DELTA):
+            _, score, seq, piece = BOARD_HEAD.unpack_from(payload)
+            player_id, offset = _unpack_str(payload, BOARD_HEAD.size)
+            name, offset = _unpack_str(payload, offset)
+            msg = {"type": "board", "id": player_id, "name": name, "score": score,
+                   "piece": SHAPES[piece - 1], "seq": seq}
+            if code == MSG_BOARD:
+                msg["locked"] = unpack_cells(payload[offset:offset + CELLS // 2])
+            else:
+                msg["type"] = "board_delta"
+                msg["ops"], _ = _unpack_ops(payload, offset)
+            return msg
+        if code == MSG_GARBAGE:
+            _, amount = GARBAGE_HEAD.unpack_from(payload)
+            sender, offset = _unpack_str(payload, GARBAGE_HEAD.size)
+            target, _ = _unpack_str(payload, offset)
+            return {"type": "garbage", "from": sender, "to": target, "amount": amount}
+        if code == MSG_JSON:
+            return json.loads(bytes(payload[1:]))
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"malformed frame: {e}") from e
+    raise ValueError(f"unknown message kind {code}")
+
+
+class FrameBuffer:
+    # Splits a byte stream into frames. Received data is copied at most once
+    # more, when a frame boundary completes; the returned frames are
+    # memoryview slices of that immutable chunk, so they can be relayed or
+    # queued without further copies.
+    def __init__(self, fmt=JSON):
+        self.format = fmt
+        self.pending = bytearray()
+        self.need = 0
+
+    def feed(self, data):
+        if self.pending:
+            self.pending += data
+            if len(self.pending) < self.need or (self.format == JSON and b"\n" not in data):
+                if len(self.pending) > HEADER.size + MAX_FRAME:
+                    raise ValueError("frame exceeds MAX_FRAME")
+                return []
+            data = bytes(self.pending)
+            self.pending = bytearray()
+        view = memoryview(data)
+        frames = []
+        offset = 0
+        size = len(data)
+        if self.format == BINARY:
+            while size - offset >= HEADER.size:
+                (length,) = HEADER.unpack_from(data, offset)
+                if length > MAX_FRAME:
+                    raise ValueError(f"frame of {length} bytes exceeds MAX_FRAME")
+                if not length:
+                    # Every message starts with its kind byte.
+                    raise ValueError("empty frame")
+                end = offset + HEADER.size + length
+                if end > size:
+                    break
+                frames.append(view[offset:end])
+                offset = end
+            self.need = HEADER.size if size - offset < HEADER.size else (
+                HEADER.size + HEADER.unpack_from(data, offset)[0])
+        else:
+            while True:
+                end = data.find(b"\n", offset)
+                if end < 0:
+                    break
+                frames.append(view[offset:end + 1])
+                offset = end + 1
+            if size - offset > MAX_FRAME:
+                raise ValueError("line exceeds MAX_FRAME")
+            self.need = 0
+        if offset < size:
+            self.pending += view[offset:]
+        return frames
+
+    def switch_format(self, fmt, unread=()):
+        # Re-split frames that were cut under the old format, plus anything pending.
+        data = b"".join(unread) + self.pending
+        self.format = fmt
+        self.pending = bytearray()
+        self.need = 0
+        return self.feed(data)
+
+
+def is_blank(frame):
+    return frame[0] in b" \t\r\n" and not bytes(frame).strip()
+
+
+def peek_type(frame, fmt):
+    # Cheap classification for relaying: "join", "garbage", "input", "board",
+    # "board_delta" or None, without parsing board frames. Only the first
+    # PEEK_LIMIT bytes of a JSON frame are looked at; NetworkGame and the
+    # authoritative server put "type" first, so boards and joins (which carry
+    # a name of any length) are told apart there, and the other messages are
+    # shorter than that.
+    if fmt == BINARY:
+        kind = frame[HEADER.size]
+        if kind == MSG_GARBAGE:
+            return "garbage"
+        if kind == MSG_BOARD:
+            return "board"
+        if kind == MSG_BOARD_DELTA:
+            return "board_delta"
+        if kind == MSG_JSON:
+            return decode(frame, fmt).get("type")
+        return None
+    text = bytes(frame[:PEEK_LIMIT])
+    if b'"type": "board"' in text:
+        return "board"
+    if b'"type": "board_delta"' in text:
+        return "board_delta"
+    if b'"type": "join"' in text:
+        return "join"
+    if len(frame) > PEEK_LIMIT:
+        return None
+    if b'"type": "input"' in text:
+        return "input"
+    if b'"join"' in text:
+        return "join"
+    if b'"garbage"' in text:
+        return "garbage"
+    return None